@@ -7,4 +7,7 @@ def init_config(config_):
     global config
     config = config_
 
+    import ajenga.app
+    ajenga.app.configure_pipeline()
+
     import ajenga.prelude
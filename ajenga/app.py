@@ -1,8 +1,12 @@
+import asyncio
+
+import ajenga
 from ajenga.event import Event, EventProvider
 from ajenga.log import logger
 from ajenga.models import ContactIdType
+from ajenga.pipeline import EventPipeline, conversation_lane_key, default_lane_key
 from ajenga.router.engine import Engine
-from ajenga.typing import Dict, Optional
+from ajenga.typing import Awaitable, Callable, Dict, List, Optional
 
 
 async def handle_event(source: EventProvider, event: Event, **kwargs):
@@ -35,6 +39,67 @@ async def handle_event(source: EventProvider, event: Event, **kwargs):
     return res
 
 
+pipeline = EventPipeline(handle_event)
+
+
+def configure_pipeline() -> None:
+    """Apply EVENT_* settings of the current config to the pipeline
+
+    Called again by `ajenga.init_config`, since this module may be imported
+    before the config is set.
+    """
+    ordered = getattr(ajenga.config, 'EVENT_ORDERED_LANES', False)
+    pipeline.configure(
+        workers=getattr(ajenga.config, 'EVENT_WORKERS', 64),
+        max_size=getattr(ajenga.config, 'EVENT_QUEUE_SIZE', 10000),
+        policy=getattr(ajenga.config, 'EVENT_SHED_POLICY', 'drop_oldest'),
+        ordered=ordered,
+        lane_key=getattr(ajenga.config, 'EVENT_LANE_KEY', None)
+        or (conversation_lane_key if ordered else default_lane_key),
+    )
+
+
+configure_pipeline()
+
+
+def handle_event_nowait(source: EventProvider, event: Event, **kwargs) -> asyncio.Future:
+    """Queue a event received from protocol into the ingestion pipeline
+
+    :param source:
+    :param event:
+    :return: Future resolved with the handling result, or None if the event was dropped
+    """
+    return pipeline.submit_nowait(source, event, **kwargs)
+
+
+_shutdown_hooks: List[Callable[[], Awaitable]] = []
+
+
+def on_shutdown(func: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    """Register a coroutine function called by `shutdown` after events are drained
+
+    :param func:
+    :return:
+    """
+    _shutdown_hooks.append(func)
+    return func
+
+
+async def shutdown(timeout: float = None) -> bool:
+    """Stop ingesting events, wait for queued ones to be handled and run shutdown hooks
+
+    :param timeout: Seconds to wait for the pipeline to drain
+    :return: True if no queued event was lost
+    """
+    drained = await pipeline.drain(timeout)
+    for hook in _shutdown_hooks:
+        try:
+            await hook()
+        except Exception as e:
+            logger.exception(e)
+    return drained
+
+
 from ajenga.provider import BotSession, ChannelProvider
 
 engine = Engine()
@@ -1,32 +1,30 @@
 import asyncio
-import time
-from dataclasses import dataclass
 
 from ajenga import app, router
-from ajenga.event import Event, EventProvider, EventType
-from ajenga.message import MessageIdType, Quote
+from ajenga.event import Event, EventProvider
+from ajenga.log import logger
+from ajenga.message import MessageIdType, MessageType, Quote
 from ajenga.provider import BotSession
 from ajenga.router import std
 from ajenga.router.keystore import KeyStore
 from ajenga.router.models import Executor, Graph, Priority, Task, TerminalNode
 from ajenga.router.state import RouteState
-from ajenga.typing import Any, List, Tuple
+from ajenga.typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Tuple, Union
+from ajenga.waitstore import encode_key, get_waiter_store, handler_ref
 
 _CANDIDATES_KEY = '_wakeup_candidates'
 _SUSPEND_OTHER_KEY = 'suspend_other'
 _SUSPEND_NEXT_PRIORITY_KEY = 'suspend_next_priority'
 
+_NEXT_WAIT = 'next'
+_QUOTE_WAIT = 'quote'
 
-class SchedulerSource(EventProvider):
-    pass
-
-
-_scheduler_source = SchedulerSource()
-
-
-@dataclass
-class SchedulerEvent(Event):
-    type: EventType = EventType.Unknown
+# Pending timeouts of waiting tasks, cancelled on wakeup
+_timeouts: Dict[Task, asyncio.TimerHandle] = {}
+# Tasks waiting for events by wait key, see `_event_wait_keys`
+_waiters: Dict[Hashable, List[Task]] = {}
+# Records of waiting tasks persisted to the waiter store
+_stored: Dict[Task, Tuple[str, int]] = {}
 
 
 class _ContextWrapperMeta(type):
@@ -50,7 +48,40 @@ class _ContextWrapperMeta(type):
     #     self.__setattr__(key, value)
 
 
+def _event_wait_keys(event: Event, source: EventProvider) -> Iterable[Hashable]:
+    key = router.message.same_event_key(event)
+    if key is not None:
+        yield _NEXT_WAIT, key
+        if MessageType.Quote in event.message.types:
+            yield _QUOTE_WAIT, event.message.get_first(Quote).id, source
+
+
+def _remove_waiter(key: Hashable, task: Task):
+    waiters = _waiters.get(key)
+    if waiters and task in waiters:
+        waiters.remove(task)
+        if not waiters:
+            del _waiters[key]
+    if task in _stored:
+        get_waiter_store().remove(*_stored.pop(task))
+
+
 class _ContextWrapper(metaclass=_ContextWrapperMeta):
+    @classmethod
+    def _prepare_wait(cls, timeout: float, suspend_other: bool, suspend_next_priority: bool, expire: Callable[[], None]):
+        task = Task.current()
+        task.state[_SUSPEND_OTHER_KEY] = suspend_other
+        task.state[_SUSPEND_NEXT_PRIORITY_KEY] = suspend_next_priority
+
+        def _expire():
+            _timeouts.pop(task, None)
+            expire()
+            if task.paused:
+                task.raise_(TimeoutError())
+
+        _timeouts[task] = asyncio.get_event_loop().call_later(timeout, _expire)
+        return task
+
     @classmethod
     async def wait_until(
         cls,
@@ -60,36 +91,44 @@ class _ContextWrapper(metaclass=_ContextWrapperMeta):
         suspend_other: bool = False,
         suspend_next_priority: bool = False,
     ):
-
-        task = Task.current()
-        task.state[_SUSPEND_OTHER_KEY] = suspend_other
-        task.state[_SUSPEND_NEXT_PRIORITY_KEY] = suspend_next_priority
-
-        async def _check_timeout():
-            cur_time = time.time()
-            if cur_time - task.last_active_time > timeout:
-                app.engine.unsubscribe_terminals([_dumpy_node])
-                if task.paused:
-                    task.raise_(TimeoutError())
-                return False
-            return True
-
         async def _add_candidate(_state: RouteState, _store: KeyStore):
             if _CANDIDATES_KEY not in _store:
                 _store[_CANDIDATES_KEY] = []
             _store[_CANDIDATES_KEY].append(
                 (task, _dumpy_node, (_state, _state.build())))
 
-        @app.on(std.if_(_check_timeout) & graph & std.process(_add_candidate))
+        @app.on(graph & std.process(_add_candidate))
         @std.handler(priority=Priority.Never, count_finished=False)
         async def _dumpy_node():
             pass
 
-        async def _set_timeout():
-            await asyncio.sleep(timeout)
-            await app.handle_event(_scheduler_source, SchedulerEvent())
+        task = cls._prepare_wait(timeout, suspend_other, suspend_next_priority,
+                                 lambda: app.engine.unsubscribe_terminals([_dumpy_node]))
 
-        asyncio.create_task(_set_timeout())
+        await task.pause()
+
+    @classmethod
+    async def _wait_key(
+        cls,
+        key: Hashable,
+        *,
+        timeout: float,
+        suspend_other: bool,
+        suspend_next_priority: bool,
+        resume: Callable[[], Awaitable] = None,
+    ):
+        """Wait for an event having the wait key, without subscribing to the engine"""
+        store = get_waiter_store() if resume else None
+        if store is not None:
+            # Raise before anything is armed or indexed
+            stored_key = encode_key(key)
+            ref = handler_ref(resume)
+
+        task = cls._prepare_wait(timeout, suspend_other, suspend_next_priority,
+                                 lambda: _remove_waiter(key, task))
+        _waiters.setdefault(key, []).append(task)
+        if store is not None:
+            _stored[task] = stored_key, store.add(stored_key, timeout, ref, suspend_other, suspend_next_priority)
 
         await task.pause()
 
@@ -101,7 +140,25 @@ class _ContextWrapper(metaclass=_ContextWrapperMeta):
         timeout: float = 3600,
         suspend_other: bool = False,
         suspend_next_priority: bool = False,
+        resume: Callable[[], Awaitable] = None,
     ):
+        """Wait for the next event of the conversation
+
+        With WAITER_STORE configured, a module level coroutine function passed
+        as `resume` is recorded and called in place of this coroutine for the
+        next event of the conversation if the process restarts meanwhile.
+        It only applies when no extra graph is given.
+        """
+        if graph is std.true:
+            key = router.message.same_event_key(this.event)
+            if key is None:
+                raise TypeError(f'Cannot wait for the next event of {this.event}')
+            return await cls._wait_key(
+                (_NEXT_WAIT, key),
+                timeout=timeout,
+                suspend_other=suspend_other,
+                suspend_next_priority=suspend_next_priority,
+                resume=resume)
         return await cls.wait_until(
             router.message.same_event_as(this.event) & graph,
             timeout=timeout,
@@ -118,9 +175,21 @@ class _ContextWrapper(metaclass=_ContextWrapperMeta):
         timeout: float = 3600,
         suspend_other: bool = False,
         suspend_next_priority: bool = False,
+        resume: Callable[[], Awaitable] = None,
     ):
+        """Wait for a message quoting the message
+
+        See `wait_next` for `resume`.
+        """
         message_id = this.event.message_id if message_id is ... else message_id
         bot = this.bot if bot is ... else bot
+        if graph is std.true:
+            return await cls._wait_key(
+                (_QUOTE_WAIT, message_id, bot),
+                timeout=timeout,
+                suspend_other=suspend_other,
+                suspend_next_priority=suspend_next_priority,
+                resume=resume)
         return await cls.wait_until(
             router.message.has(Quote)
             & std.if_(lambda event, source: event.message.get_first(Quote).id
@@ -142,10 +211,26 @@ async def _check_wait(_store: KeyStore):
         candi.priority = Task.current().priority
         candi.args = args
         Executor.current().add_task(candi)
-        app.engine.unsubscribe_terminals([node])
-
-    candidates: List[Tuple[Task, TerminalNode,
+        if isinstance(node, TerminalNode):
+            app.engine.unsubscribe_terminals([node])
+        else:
+            _remove_waiter(node, candi)
+        handle = _timeouts.pop(candi, None)
+        if handle:
+            handle.cancel()
+
+    candidates: List[Tuple[Task, Union[TerminalNode, Hashable],
                            Any]] = _store.get(_CANDIDATES_KEY, [])
+    waiter_store = get_waiter_store()
+    restored = []
+    if _waiters or waiter_store:
+        for key in _event_wait_keys(_store['event'], _store['source']):
+            if key in _waiters:
+                for task in _waiters[key]:
+                    candidates.append((task, key, Task.current().args))
+            elif waiter_store:
+                # Waits recorded before a restart
+                restored.extend(waiter_store.pop(encode_key(key)))
     candidates.sort(key=lambda e: e[0].last_active_time)
 
     _suspend_other = False
@@ -157,6 +242,30 @@ async def _check_wait(_store: KeyStore):
         _suspend_next_priority |= candidate.state[_SUSPEND_NEXT_PRIORITY_KEY]
         _wakeup(candidate, dumpy_node, arguments)
 
+    while restored:
+        stored = restored.pop()
+        if _suspend_other:
+            waiter_store.restore(stored)
+            continue
+        try:
+            handler = stored.resolve()
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'Failed to resolve stored waiter {stored.handler}')
+            continue
+        if handler is None:
+            # Kept until the plugin of the handler is loaded
+            waiter_store.restore(stored)
+            continue
+        _suspend_other = stored.suspend_other
+        _suspend_next_priority |= stored.suspend_next_priority
+        # Run in a task of its own like a woken up wait, so the handler may
+        # wait again without pausing this one
+        task = Task(app.engine.handler_cls(handler))
+        task.priority = Task.current().priority
+        task.args = Task.current().args
+        Executor.current().add_task(task)
+
     if _suspend_next_priority:
         Executor.current().next_priority = False
 
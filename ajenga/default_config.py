@@ -1,15 +1,40 @@
-from ajenga.typing import Any, Container, Dict
+from ajenga.typing import Any, Callable, Container, Dict, Hashable, Optional
 
 PLUGIN_INFO_FILE: str = 'plugin.json'
 
 PLUGIN_MODULE_PREFIX: str = 'plugins'
 PLUGIN_DIR: str = './plugins'
+LAZY_PLUGIN_IDLE_UNLOAD: Optional[float] = None  # Seconds idle before unloading a lazy plugin
+PLUGIN_UNLOAD_MEASURE: bool = False  # Log memory blocks reclaimed by unloading, forcing garbage collections
 RESOURCE_DIR: str = './res'
 DATA_DIR: str = './data'
 TEMP_DIR: str = './temp'
 
 LOG_DIR: str = './logs'
 
+EVENT_WORKERS: int = 64  # 0 to handle every event in its own task
+EVENT_QUEUE_SIZE: int = 10000
+EVENT_SHED_POLICY: str = 'drop_oldest'  # or 'drop_new'
+EVENT_ORDERED_LANES: bool = False  # Handle events of a conversation in order
+EVENT_LANE_KEY: Optional[Callable[[Any, Any], Hashable]] = None  # (source, event) -> lane
+
+WAITER_STORE: Optional[str] = None  # SQLite file persisting resumable waits, e.g. './data/waiters.db'
+
+SERVICE_CONFIG_DB: str = './service_config/services.db'
+SERVICE_CONFIG_FLUSH_DELAY: float = 5.  # Seconds changed service configs are kept before saving
+SERVICE_CONFIG_FLUSH_CHANGES: int = 100  # Save at once after this many changes
+
+GROUP_ROSTER_TTL: float = 300.  # Seconds group lists of bots are cached
+
+BROADCAST_RATE: float = 5.  # Messages per second of a bot
+BROADCAST_BURST: int = 5
+BROADCAST_CONCURRENCY: int = 4  # Groups sent at once by a bot
+BROADCAST_RETRIES: int = 3
+BROADCAST_RETRY_DELAY: float = 1.  # Doubled on each retry
+
+MEDIA_FETCH_LIMIT_PER_HOST: int = 8  # Connections of media downloads per host
+MEDIA_FETCH_TIMEOUT: float = 60.
+
 APSCHEDULER_CONFIG: Dict[str, Any] = {'apscheduler.timezone': 'Asia/Shanghai'}
 
 SUPERUSERS: Container[int] = []
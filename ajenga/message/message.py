@@ -8,8 +8,9 @@ from enum import Enum
 import ajenga
 from ajenga.message.code import StructCode, escape, unescape
 from ajenga.models import ContactIdType
-from ajenga.typing import (TYPE_CHECKING, ClassVar, Iterable, List, Optional,
-                           Tuple, Type, TypeVar, Union)
+from ajenga.typing import (TYPE_CHECKING, Any, Callable, ClassVar, Dict,
+                           FrozenSet, Hashable, Iterable, List, Optional, Tuple, Type,
+                           TypeVar, Union)
 
 if TYPE_CHECKING:
     from ajenga.app import BotSession
@@ -96,14 +97,20 @@ class MessageElement(StructCode):
 
 
 M = TypeVar('M', bound=MessageElement)
+T = TypeVar('T')
 
 
 class MessageChain(List[MessageElement], StructCode):
     __struct_type__ = StructCode._LIST_TYPE
 
+    _memo: Dict[Hashable, Any]
+    _types: Optional[FrozenSet[MessageType]]
+
     def __init__(self,
                  msgs: Union[str, MessageElement,
                              Iterable[MessageElement]] = ...):
+        self._memo = {}
+        self._types = None
         super().__init__()
         if msgs is ...:
             pass
@@ -123,6 +130,107 @@ class MessageChain(List[MessageElement], StructCode):
         else:
             raise ValueError(f'Not a valid MessageChain: {msgs}!')
 
+    def memoize(self, key: Hashable, func: Callable[["MessageChain"], T]) -> T:
+        """Get a value derived from this chain, computed at most once
+
+        Memoized values are dropped as soon as the chain is mutated.
+
+        :param key: Key of the derived value
+        :param func: Function computing the value from this chain
+        :return: Derived value
+        """
+        memo = self.__dict__.setdefault('_memo', {})
+        try:
+            return memo[key]
+        except KeyError:
+            value = memo[key] = func(self)
+            return value
+
+    @property
+    def types(self) -> FrozenSet[MessageType]:
+        """Types of all elements in this chain, kept up to date on mutation"""
+        types = self.__dict__.get('_types')
+        if types is None:
+            types = self._types = frozenset(element.type for element in self)
+        return types
+
+    def _mutated(self, added: Iterable[MessageElement] = None):
+        memo = self.__dict__.get('_memo')
+        if memo:
+            memo.clear()
+        types = self.__dict__.get('_types')
+        if types is not None:
+            if added is None:
+                self._types = None
+            else:
+                added_types = set(element.type for element in added)
+                if not added_types <= types:
+                    self._types = types | added_types
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_memo', None)
+        state.pop('_types', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memo = {}
+        self._types = None
+
+    def append(self, element: MessageElement) -> None:
+        super().append(element)
+        self._mutated((element, ))
+
+    def extend(self, elements: Iterable[MessageElement]) -> None:
+        size = len(self)
+        super().extend(elements)
+        self._mutated(self[size:])
+
+    def insert(self, index: int, element: MessageElement) -> None:
+        super().insert(index, element)
+        self._mutated((element, ))
+
+    def remove(self, element: MessageElement) -> None:
+        super().remove(element)
+        self._mutated()
+
+    def pop(self, index: int = -1) -> MessageElement:
+        element = super().pop(index)
+        self._mutated()
+        return element
+
+    def clear(self) -> None:
+        super().clear()
+        self._mutated()
+
+    def sort(self, *args, **kwargs) -> None:
+        super().sort(*args, **kwargs)
+        self._mutated(())
+
+    def reverse(self) -> None:
+        super().reverse()
+        self._mutated(())
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._mutated()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._mutated()
+
+    def __iadd__(self, other):
+        size = len(self)
+        result = super().__iadd__(other)
+        self._mutated(self[size:])
+        return result
+
+    def __imul__(self, other):
+        result = super().__imul__(other)
+        self._mutated()
+        return result
+
     def as_plain(self) -> str:
         return ''.join(x.as_plain() for x in self).lstrip()
 
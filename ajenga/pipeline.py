@@ -0,0 +1,274 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+
+from ajenga.event import Event, EventProvider
+from ajenga.log import logger
+from ajenga.router.message import same_event_key
+from ajenga.typing import (Any, Awaitable, Callable, Deque, Dict, Hashable,
+                           List, Optional, Set, Tuple)
+
+
+class ShedPolicy:
+    DROP_NEW = 'drop_new'
+    DROP_OLDEST = 'drop_oldest'
+
+
+@dataclass
+class PipelineStats:
+    depth: int = 0
+    peak_depth: int = 0
+    running: int = 0
+    submitted: int = 0
+    processed: int = 0
+    dropped: int = 0
+    total_wait: float = 0.
+    max_wait: float = 0.
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.processed if self.processed else 0.
+
+
+def default_lane_key(source: EventProvider, event: Event) -> Hashable:
+    return source, getattr(event, 'group', None)
+
+
+def conversation_lane_key(source: EventProvider, event: Event) -> Optional[Hashable]:
+    """Lane per conversation as matched by `router.message.same_event_as`
+
+    Events out of any conversation share the unordered lane None.
+    """
+    key = same_event_key(event)
+    return None if key is None else (source, key)
+
+
+class _Item:
+    __slots__ = ('source', 'event', 'kwargs', 'future', 'enqueued')
+
+    def __init__(self, source, event, kwargs, future, enqueued):
+        self.source = source
+        self.event = event
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued = enqueued
+
+
+class EventPipeline:
+    """Bounded ingestion queue with a worker pool in front of handle_event
+
+    Events are queued into lanes by `lane_key`, by default per source and
+    group. Workers take lanes in round robin so a noisy group cannot starve
+    the others, and the noisiest lane is shed first when the queue overflows.
+
+    With `ordered`, events of a lane are handled one after another in arrival
+    order while different lanes still run in parallel. The lane None is never
+    ordered.
+    """
+
+    def __init__(self,
+                 handler: Callable[..., Awaitable[Any]],
+                 *,
+                 workers: int = 64,
+                 max_size: int = 10000,
+                 policy: str = ShedPolicy.DROP_OLDEST,
+                 ordered: bool = False,
+                 lane_key: Callable[[EventProvider, Event], Hashable] = None):
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.policy = policy
+        self.ordered = ordered
+        self.lane_key = lane_key or (conversation_lane_key if ordered else default_lane_key)
+        self.stats = PipelineStats()
+
+        # Lanes queued or being handled in order
+        self._lanes: Dict[Hashable, Deque[_Item]] = {}
+        # Lanes having events to take, each at most once
+        self._ready: Deque[Hashable] = deque()
+        self._busy: Set[Hashable] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+        self._closed = False
+        # Workers are being cancelled by `drain`
+        self._stopping = False
+
+    def configure(self, **kwargs) -> None:
+        if self._tasks:
+            raise RuntimeError('Cannot configure a running pipeline')
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise AttributeError(f'Unknown pipeline option {key}')
+            setattr(self, key, value)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit_nowait(self, source: EventProvider, event: Event, **kwargs) -> asyncio.Future:
+        """Queue an event without waiting, shedding by policy if the queue is full
+
+        :return: Future resolved with the handling result, or None if the event was dropped
+        """
+        if self.workers <= 0:
+            return asyncio.ensure_future(self.handler(source, event, **kwargs))
+
+        future = asyncio.get_event_loop().create_future()
+        if self._closed:
+            logger.warning(f'Pipeline closed, dropped {event}')
+            self._drop(future)
+        elif self.stats.depth >= self.max_size and not self._shed():
+            logger.warning(f'Pipeline full, dropped {event}')
+            self._drop(future)
+        else:
+            self._put(_Item(source, event, kwargs, future, asyncio.get_event_loop().time()))
+        return future
+
+    async def submit(self, source: EventProvider, event: Event, **kwargs) -> asyncio.Future:
+        """Queue an event, waiting for free space if the queue is full
+
+        :return: Future resolved with the handling result
+        """
+        if self.workers <= 0 or self._closed:
+            return self.submit_nowait(source, event, **kwargs)
+        self._ensure_started()
+        while self.stats.depth >= self.max_size:
+            self._space.clear()
+            await self._space.wait()
+        return self.submit_nowait(source, event, **kwargs)
+
+    def _drop(self, future: asyncio.Future):
+        self.stats.dropped += 1
+        future.set_result(None)
+
+    def _shed(self) -> bool:
+        if self.policy != ShedPolicy.DROP_OLDEST or not self.stats.depth:
+            return False
+        key, lane = max(self._lanes.items(), key=lambda kv: len(kv[1]))
+        item = lane.popleft()
+        if not lane and key not in self._busy:
+            del self._lanes[key]
+            self._ready.remove(key)
+        self.stats.depth -= 1
+        logger.warning(f'Pipeline full, shed {item.event}')
+        self._drop(item.future)
+        return True
+
+    def _put(self, item: _Item):
+        self._ensure_started()
+        key = self.lane_key(item.source, item.event)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+        lane.append(item)
+        if len(lane) == 1 and key not in self._busy:
+            self._ready.append(key)
+            self._wakeup.set()
+
+        stats = self.stats
+        stats.submitted += 1
+        stats.depth += 1
+        stats.peak_depth = max(stats.peak_depth, stats.depth)
+
+    def _take(self) -> Optional[Tuple[Hashable, _Item]]:
+        if self._ready:
+            key = self._ready.popleft()
+            lane = self._lanes[key]
+            item = lane.popleft()
+            if self.ordered and key is not None:
+                self._busy.add(key)
+            elif lane:
+                self._ready.append(key)
+            else:
+                del self._lanes[key]
+            self.stats.depth -= 1
+            return key, item
+        return None
+
+    def _done(self, key: Hashable):
+        if key not in self._busy:
+            return
+        self._busy.discard(key)
+        if self._lanes[key]:
+            self._ready.append(key)
+            self._wakeup.set()
+        else:
+            del self._lanes[key]
+
+    async def _worker(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            taken = self._take()
+            if taken is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            key, item = taken
+            self._space.set()
+
+            stats = self.stats
+            wait = loop.time() - item.enqueued
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            stats.running += 1
+            result = None
+            try:
+                result = await self.handler(item.source, item.event, **item.kwargs)
+            except asyncio.CancelledError:
+                # Raised by the handler itself unless workers are stopping,
+                # the worker keeps serving either way the item is resolved
+                if self._stopping:
+                    raise
+                logger.warning(f'Handling cancelled {item.event}')
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                stats.running -= 1
+                stats.processed += 1
+                self._done(key)
+                if not item.future.done():
+                    item.future.set_result(result)
+
+    async def drain(self, timeout: float = None) -> bool:
+        """Stop accepting events and wait for all queued events to be handled
+
+        :param timeout: Seconds to wait before cancelling workers
+        :return: True if every queued event was handled
+        """
+        self._closed = True
+        if not self._tasks:
+            return True
+
+        async def _wait():
+            while self.stats.depth or self.stats.running:
+                await asyncio.sleep(0.05)
+
+        try:
+            await asyncio.wait_for(_wait(), timeout)
+            drained = True
+        except asyncio.TimeoutError:
+            logger.warning(f'Pipeline drain timeout with {self.stats.depth} events queued')
+            drained = False
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._stopping = False
+        # Events never taken are dropped so nobody awaits them forever
+        for lane in self._lanes.values():
+            for item in lane:
+                self._drop(item.future)
+        self._lanes.clear()
+        self._ready.clear()
+        self._busy.clear()
+        self.stats.depth = 0
+        return drained
@@ -2,13 +2,20 @@ from .service import Privilege
 from .service import Service
 from .service import remove_service
 from .service import set_current_plugin
+from .service import staged_subscriptions
+from .service import save_service_configs
+from .roster import group_roster
+from .broadcast import BroadcastTask
 from .plugin import Plugin
 from .plugin import get_current_plugin
 from .plugin import get_loaded_plugins
 from .plugin import get_plugin
 from .plugin import load_plugin
+from .plugin import load_plugins
 from .plugin import reload_plugin
 from .plugin import unload_plugin
+from .lazy import LazyPlugin
+from .lazy import get_lazy_plugins
 from .res import DirectoryType
 from .res import ensure_file_path
 from .res import get_plugin_dir
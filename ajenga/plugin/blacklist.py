@@ -0,0 +1,172 @@
+import asyncio
+import heapq
+import time
+from datetime import datetime, timedelta
+
+from ajenga.log import logger
+from ajenga.models import ContactIdType
+from ajenga.typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from .store import ServiceConfigStore
+
+Duration_T = Union[timedelta, float]
+
+
+def _seconds(duration: Duration_T) -> float:
+    return duration.total_seconds() if isinstance(duration, timedelta) else float(duration)
+
+
+class Blacklist:
+    """Expiring blacklist of contacts
+
+    Membership of ids not blocked is a plain dict lookup. Deadlines are kept
+    on the monotonic clock in a heap swept by a loop timer armed for the
+    earliest one, and entries are persisted to the config store with wall
+    clock deadlines so blocks survive restarts.
+    """
+
+    def __init__(self,
+                 kind: str,
+                 store: Callable[[], ServiceConfigStore] = None,
+                 submit: Callable[..., None] = None):
+        """
+        :param kind: Name of the list in the store
+        :param store: Getter of the config store, not persisted if None
+        :param submit: Runs a store write in background, called with func and args
+        """
+        self.kind = kind
+        self._store = store
+        self._submit = submit
+        self._deadlines: Dict[ContactIdType, float] = {}
+        self._heap: List[Tuple[float, ContactIdType]] = []
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._handle_deadline = float('inf')
+        self._loaded = store is None
+
+    def __contains__(self, contact: ContactIdType) -> bool:
+        if not self._loaded:
+            self._load()
+        if contact not in self._deadlines:
+            return False
+        if time.monotonic() >= self._deadlines[contact]:
+            # Sweeper not run yet, e.g. no running loop
+            self.remove(contact)
+            return False
+        return True
+
+    def __len__(self) -> int:
+        if not self._loaded:
+            self._load()
+        return len(self._deadlines)
+
+    def add(self, contact: ContactIdType, duration: Duration_T) -> None:
+        self.add_many([contact], duration)
+
+    def add_many(self, contacts: Iterable[ContactIdType], duration: Duration_T) -> None:
+        """Block contacts for a duration, replacing existing deadlines
+
+        :param contacts: Group ids or qq
+        :param duration: timedelta or seconds
+        """
+        if not self._loaded:
+            self._load()
+        seconds = _seconds(duration)
+        deadline = time.monotonic() + seconds
+        contacts = list(contacts)
+        for contact in contacts:
+            self._deadlines[contact] = deadline
+            heapq.heappush(self._heap, (deadline, contact))
+        self._arm()
+        self._write(ServiceConfigStore.save_blacklist, self.kind,
+                    {contact: time.time() + seconds for contact in contacts})
+
+    def remove(self, contact: ContactIdType) -> None:
+        self.remove_many([contact])
+
+    def remove_many(self, contacts: Iterable[ContactIdType]) -> None:
+        if not self._loaded:
+            self._load()
+        removed = [contact for contact in contacts if self._deadlines.pop(contact, None) is not None]
+        # Heap entries are dropped lazily by the sweeper
+        if removed:
+            self._write(ServiceConfigStore.remove_blacklist, self.kind, removed)
+
+    def expire_time(self, contact: ContactIdType) -> Optional[datetime]:
+        """Get when the block of a contact expires, None if not blocked"""
+        if contact not in self:
+            return None
+        return datetime.now() + timedelta(seconds=self._deadlines[contact] - time.monotonic())
+
+    def items(self) -> Dict[ContactIdType, datetime]:
+        """Get all blocked contacts with their expire time"""
+        self.sweep()
+        now, mono = datetime.now(), time.monotonic()
+        return {contact: now + timedelta(seconds=deadline - mono) for contact, deadline in self._deadlines.items()}
+
+    def sweep(self) -> int:
+        """Remove expired entries
+
+        :return: Number of entries removed
+        """
+        if not self._loaded:
+            self._load()
+        now = time.monotonic()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, contact = heapq.heappop(self._heap)
+            if self._deadlines.get(contact) == deadline:
+                del self._deadlines[contact]
+                expired.append(contact)
+        if expired:
+            self._write(ServiceConfigStore.remove_blacklist, self.kind, expired)
+        return len(expired)
+
+    def _on_timer(self):
+        self._handle = None
+        self._handle_deadline = float('inf')
+        self.sweep()
+        self._arm()
+
+    def _arm(self):
+        if not self._heap or self._heap[0][0] >= self._handle_deadline:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._handle:
+            self._handle.cancel()
+        self._handle_deadline = self._heap[0][0]
+        self._handle = loop.call_later(max(self._handle_deadline - time.monotonic(), 0), self._on_timer)
+
+    def _load(self):
+        self._loaded = True
+        try:
+            entries = self._store().load_blacklist(self.kind)
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'Failed to load {self.kind} blacklist')
+            return
+        now, mono = time.time(), time.monotonic()
+        for contact, expires in entries.items():
+            deadline = mono + expires - now
+            self._deadlines[contact] = deadline
+            self._heap.append((deadline, contact))
+        heapq.heapify(self._heap)
+        self._arm()
+
+    def _write(self, func: Callable, *args):
+        if self._store is None:
+            return
+
+        def _run():
+            try:
+                func(self._store(), *args)
+            except Exception as e:
+                logger.exception(e)
+                logger.error(f'Failed to save {self.kind} blacklist')
+
+        if self._submit:
+            self._submit(_run)
+        else:
+            _run()
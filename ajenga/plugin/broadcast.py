@@ -0,0 +1,191 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import ajenga
+from ajenga import app
+from ajenga.log import Logger, logger
+from ajenga.message import Message_T
+from ajenga.models import ContactIdType
+from ajenga.typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+
+class TokenBucket:
+    """Token bucket limiting sends of a bot session"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Buckets are per session so concurrent broadcasts share the limit
+_buckets: Dict[ContactIdType, TokenBucket] = {}
+
+
+def get_bucket(qq: ContactIdType) -> TokenBucket:
+    rate = getattr(ajenga.config, 'BROADCAST_RATE', 5.)
+    burst = getattr(ajenga.config, 'BROADCAST_BURST', 5)
+    bucket = _buckets.get(qq)
+    if bucket is None:
+        bucket = _buckets[qq] = TokenBucket(rate, burst)
+    return bucket
+
+
+@dataclass
+class BroadcastStats:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    messages: int = 0
+    total_latency: float = 0.
+    max_latency: float = 0.
+
+    @property
+    def finished(self) -> int:
+        return self.sent + self.failed
+
+    @property
+    def progress(self) -> float:
+        return self.finished / self.total if self.total else 1.
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.messages if self.messages else 0.
+
+
+class BroadcastTask:
+    """Broadcast of messages to groups, sent in parallel across bot sessions
+
+    Groups of a session are sent through its token bucket by a few workers,
+    each message is retried with exponential backoff. Progress is kept per
+    group and message so an interrupted or partly failed broadcast can be
+    resumed with `run` again.
+    """
+
+    def __init__(self,
+                 messages: Iterable[Message_T],
+                 targets: Dict[ContactIdType, ContactIdType],
+                 *,
+                 interval: float = None,
+                 retries: int = None,
+                 on_progress: Callable[["BroadcastTask"], Any] = None,
+                 logger: Logger = logger):
+        """
+        :param messages: Messages sent to every group in order
+        :param targets: Dict of group to the bot qq sending to it
+        :param interval: Seconds between sends of a session, BROADCAST_RATE if None
+        :param retries: Retries of a failed send, BROADCAST_RETRIES if None
+        :param on_progress: Called after each group finished
+        :param logger: Logger
+        """
+        self.messages = list(messages)
+        self.targets = dict(targets)
+        self.interval = interval
+        self.retries = getattr(ajenga.config, 'BROADCAST_RETRIES', 3) if retries is None else retries
+        self.on_progress = on_progress
+        self.logger = logger
+        self.stats = BroadcastStats(total=len(self.targets))
+        # Index of the next message to send to each unfinished group
+        self._progress: Dict[ContactIdType, int] = {group: 0 for group in self.targets}
+        self.failed: Dict[ContactIdType, str] = {}
+        self._running: Optional[asyncio.Future] = None
+
+    @property
+    def pending(self) -> List[ContactIdType]:
+        """Groups not finished yet, including failed ones"""
+        return list(self._progress)
+
+    @property
+    def done(self) -> bool:
+        return not self._progress
+
+    async def run(self) -> "BroadcastTask":
+        """Send to all unfinished groups, also resumes a cancelled or failed broadcast"""
+        if self._running is not None:
+            raise RuntimeError('Broadcast is running')
+        self.stats.failed -= len(self.failed)
+        self.failed.clear()
+
+        queues: Dict[ContactIdType, Deque[ContactIdType]] = {}
+        for group in self._progress:
+            queues.setdefault(self.targets[group], deque()).append(group)
+        buckets = {qq: TokenBucket(1 / self.interval) if self.interval else get_bucket(qq) for qq in queues}
+        concurrency = getattr(ajenga.config, 'BROADCAST_CONCURRENCY', 4)
+        self._running = asyncio.gather(*(
+            self._worker(qq, queue, buckets[qq]) for qq, queue in queues.items() for _ in range(concurrency)))
+        try:
+            await self._running
+        finally:
+            self._running = None
+        stats = self.stats
+        self.logger.info(f'Broadcast finished: {stats.sent}/{stats.total} sent, {stats.failed} failed, '
+                         f'{stats.retries} retries, average latency {stats.average_latency:.3f}s')
+        return self
+
+    def cancel(self) -> None:
+        """Stop sending, progress is kept for resuming"""
+        if self._running is not None:
+            self._running.cancel()
+
+    async def _worker(self, qq: ContactIdType, queue: Deque[ContactIdType], bucket: TokenBucket):
+        while queue:
+            group = queue.popleft()
+            error = await self._send_group(qq, group, bucket)
+            if error is None:
+                self.stats.sent += 1
+                del self._progress[group]
+            else:
+                # Kept in progress to be resumed
+                self.stats.failed += 1
+                self.failed[group] = error
+                self.logger.error(f'Failed to broadcast to group {group}: {error}')
+            if self.on_progress:
+                self.on_progress(self)
+
+    async def _send_group(self, qq: ContactIdType, group: ContactIdType, bucket: TokenBucket) -> Optional[str]:
+        while self._progress[group] < len(self.messages):
+            message = self.messages[self._progress[group]]
+            error = None
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.stats.retries += 1
+                    await asyncio.sleep(getattr(ajenga.config, 'BROADCAST_RETRY_DELAY', 1.) * 2 ** (attempt - 1))
+                session = app.get_session(qq)
+                if session is None:
+                    return f'Session {qq} not found'
+                await bucket.acquire()
+                start = time.monotonic()
+                try:
+                    result = await session.api.send_group_message(group=group, message=message)
+                except Exception as e:
+                    self.logger.exception(e)
+                    error = repr(e)
+                    continue
+                if result.ok:
+                    latency = time.monotonic() - start
+                    self.stats.messages += 1
+                    self.stats.total_latency += latency
+                    self.stats.max_latency = max(self.stats.max_latency, latency)
+                    error = None
+                    break
+                error = f'{result.code} {result.message}'
+            if error is not None:
+                return error
+            self._progress[group] += 1
+        return None
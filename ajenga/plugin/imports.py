@@ -0,0 +1,116 @@
+import sys
+import time
+from importlib.abc import MetaPathFinder
+
+from ajenga.typing import Dict, List, Set, Tuple
+
+
+class ImportRecord:
+    """Modules imported while recording with their import time
+
+    Times are self times in seconds, excluding nested imports.
+    """
+
+    def __init__(self):
+        self.modules: Dict[str, float] = {}
+
+    @property
+    def total(self) -> float:
+        return sum(self.modules.values())
+
+    def slowest(self, n: int = 5) -> List[Tuple[str, float]]:
+        return sorted(self.modules.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+
+_records: List[ImportRecord] = []
+# Modules ever imported of tracked packages
+_packages: Dict[str, Set[str]] = {}
+# Time spent in nested imports of each module being executed
+_nested: List[float] = []
+
+
+def _timed_exec(name: str, exec_module):
+    def _exec(module):
+        if not _records:
+            return exec_module(module)
+        start = time.perf_counter()
+        _nested.append(0.)
+        try:
+            return exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = _nested.pop()
+            if _nested:
+                _nested[-1] += elapsed
+            for record in _records:
+                record.modules[name] = elapsed - nested
+
+    return _exec
+
+
+class _ImportHook(MetaPathFinder):
+    """Tracks modules of packages and times module execution by wrapping
+    loaders found by other finders"""
+
+    def find_spec(self, fullname, path, target=None):
+        if _packages:
+            package = fullname
+            while package not in _packages and '.' in package:
+                package = package.rpartition('.')[0]
+            if package in _packages:
+                _packages[package].add(fullname)
+        if not _records:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        # Builtin and frozen importers are classes shared by all modules
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, 'exec_module'):
+            loader.exec_module = _timed_exec(fullname, loader.exec_module)
+        return spec
+
+
+_hook = _ImportHook()
+
+
+def _install():
+    if _hook not in sys.meta_path:
+        sys.meta_path.insert(0, _hook)
+
+
+def track_package(package: str) -> Set[str]:
+    """Track modules of a package imported from now on
+
+    :param package: Package name
+    :return: Set of module names updated on import, including the package itself
+    """
+    _install()
+    return _packages.setdefault(package, set())
+
+
+def untrack_package(package: str) -> Set[str]:
+    return _packages.pop(package, set())
+
+
+class record_imports:
+    """Context manager recording modules imported inside
+
+    Records may be nested, an import is recorded by all active ones.
+    """
+
+    def __init__(self):
+        self.record = ImportRecord()
+
+    def __enter__(self) -> ImportRecord:
+        _install()
+        _records.append(self.record)
+        return self.record
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _records.remove(self.record)
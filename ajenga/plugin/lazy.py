@@ -0,0 +1,186 @@
+import asyncio
+import time
+
+import ajenga
+import ajenga.router as router
+from ajenga import app
+from ajenga.event import EventType
+from ajenga.log import logger
+from ajenga.router import std
+from ajenga.router.engine import Engine
+from ajenga.router.keystore import KeyStore
+from ajenga.router.models import Graph, Priority, TerminalNode
+from ajenga.typing import Dict, List, Optional
+
+from .plugin import Plugin, _import_plugin, _start_plugin, get_plugin, unload_plugin
+
+
+def _trigger_graphs(triggers: Dict) -> List[Graph]:
+    """Build graphs from "triggers" of plugin info
+
+    Supported triggers are "commands" (message prefixes), "keywords",
+    "channels" and "event_types" (values of `EventType`).
+    """
+    graphs = []
+    if triggers.get('commands'):
+        graphs.append(router.message.is_message & router.message.startswith(*triggers['commands']))
+    if triggers.get('keywords'):
+        graphs.append(router.message.is_message & router.message.contains(*triggers['keywords']))
+    for channel in triggers.get('channels', []):
+        graphs.append(router.channel(channel))
+    if triggers.get('event_types'):
+        graphs.append(router.event_type_is(*map(EventType, triggers['event_types'])))
+    return graphs
+
+
+class LazyPlugin:
+    """Plugin imported on the first event matching its triggers
+
+    Stub handlers are subscribed for the triggers declared in plugin info.
+    The first matching event imports the plugin and is dispatched again to
+    its services alone. Stubs stay subscribed to track activity, so the
+    plugin can be unloaded after being idle and imported again on demand.
+    """
+
+    def __init__(self, module_path: str, plugin_dir: str, info: Dict):
+        self.module_path = module_path
+        self.plugin_dir = plugin_dir
+        self.info = info
+        self.name: str = info['name']
+        self.idle_unload: Optional[float] = info.get(
+            'idle_unload', getattr(ajenga.config, 'LAZY_PLUGIN_IDLE_UNLOAD', None))
+        self.last_active = 0.
+        self._stubs: List[TerminalNode] = []
+        self._lock = asyncio.Lock()
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def plugin(self) -> Optional[Plugin]:
+        """The loaded plugin, looked up each time as it may be reloaded or unloaded elsewhere"""
+        return get_plugin(self.name)
+
+    def register(self) -> None:
+        graphs = _trigger_graphs(self.info.get('triggers', {}))
+        if not graphs:
+            logger.warning(f'Lazy Plugin {self.name} declares no triggers, it will never be loaded')
+
+        for graph in graphs:
+            @app.on(graph)
+            @std.handler(priority=Priority.Wakeup, count_finished=False)
+            async def _stub(_store: KeyStore):
+                await self._on_trigger(_store)
+
+            self._stubs.append(_stub)
+
+    def unregister(self) -> None:
+        app.engine.unsubscribe_terminals(self._stubs)
+        self._stubs = []
+        if self._idle_handle:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+    async def _on_trigger(self, store: KeyStore):
+        self.last_active = time.monotonic()
+        if self.plugin is not None:
+            return
+        async with self._lock:
+            if self.plugin is not None:
+                return
+            if not await self.activate():
+                return
+        await self._redispatch(store)
+
+    async def activate(self) -> bool:
+        """Import the plugin if not imported
+
+        :return: Success or not
+        """
+        if self.plugin is not None:
+            return True
+        start = time.perf_counter()
+        plugin = await _import_plugin(self.module_path, self.plugin_dir, self.info)
+        if plugin is None:
+            logger.error(f'Failed to activate lazy Plugin {self.name}')
+            return False
+        await _start_plugin(plugin)
+        logger.info(f'Activated lazy Plugin "{self.name}" in {time.perf_counter() - start:.3f}s')
+        self.last_active = time.monotonic()
+        self._arm_idle()
+        return True
+
+    async def deactivate(self) -> bool:
+        """Unload the plugin, it is imported again on the next trigger
+
+        :return: Success or not
+        """
+        async with self._lock:
+            plugin = self.plugin
+            if plugin is None:
+                return True
+            if not await unload_plugin(plugin):
+                return False
+        logger.info(f'Unloaded idle lazy Plugin "{self.name}"')
+        return True
+
+    async def _redispatch(self, store: KeyStore):
+        plugin = self.plugin
+        if plugin is None:
+            return
+        # Only services of this plugin, others have handled the event already
+        engine = Engine()
+        for service in plugin.services.values():
+            for graph in service._graphs:
+                engine.subscribe(graph.copy())
+        kwargs = {'bot': store['bot']} if 'bot' in store else {}
+        async for result in engine.forward(event=store['event'], source=store['source'], **kwargs):
+            if isinstance(result, Exception):
+                logger.exception(result)
+                logger.error(f'Error handling event by lazy Plugin {self.name}')
+
+    def _arm_idle(self):
+        if not self.idle_unload or self.plugin is None:
+            return
+        idle = time.monotonic() - self.last_active
+        if idle >= self.idle_unload:
+            asyncio.ensure_future(self.deactivate())
+            self._idle_handle = None
+        else:
+            self._idle_handle = asyncio.get_event_loop().call_later(self.idle_unload - idle, self._arm_idle)
+
+
+_lazy_plugins: Dict[str, LazyPlugin] = {}
+
+
+def add_lazy_plugin(module_path: str, plugin_dir: str, info: Dict) -> Optional[LazyPlugin]:
+    """Register a lazy Plugin by its triggers without importing it
+
+    :param module_path: Plugin module path
+    :param plugin_dir: Plugin directory
+    :param info: Plugin info
+    :return: LazyPlugin object
+    """
+    if info.get('name') in _lazy_plugins:
+        logger.error(f'Lazy Plugin {info["name"]} already exists')
+        return None
+    lazy = LazyPlugin(module_path, plugin_dir, info)
+    lazy.register()
+    _lazy_plugins[lazy.name] = lazy
+    logger.info(f'Registered lazy Plugin "{lazy.name}" with {len(lazy._stubs)} triggers')
+    return lazy
+
+
+async def remove_lazy_plugin(name: str) -> bool:
+    """Unregister a lazy Plugin, unloading it if imported
+
+    :param name: Plugin name
+    :return: Success or not
+    """
+    lazy = _lazy_plugins.pop(name, None)
+    if lazy is None:
+        return False
+    lazy.unregister()
+    return await lazy.deactivate()
+
+
+def get_lazy_plugins() -> Dict[str, LazyPlugin]:
+    return _lazy_plugins.copy()
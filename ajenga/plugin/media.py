@@ -0,0 +1,100 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+
+import aiohttp
+
+import ajenga
+from ajenga import app
+from ajenga.log import logger
+from ajenga.typing import Callable, Dict, Optional, Tuple
+
+_CHUNK_SIZE = 64 * 1024
+# Bytes of the head given to `suffix` to name the file
+_HEAD_SIZE = 32
+# Mode of files created by `open`, as temp files are created with 0600
+_umask = os.umask(0)
+os.umask(_umask)
+_FILE_MODE = 0o666 & ~_umask
+
+
+def _write_chunk(f, md5, chunk: bytes):
+    f.write(chunk)
+    md5.update(chunk)
+
+
+class MediaFetcher:
+    """Shared downloader of media files
+
+    Downloads share a pooled session limited per host and are streamed into
+    a temp file hashed incrementally off the event loop, then renamed to
+    the md5 named file atomically. Concurrent downloads of the same url into
+    the same directory share one request.
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=getattr(ajenga.config, 'MEDIA_FETCH_LIMIT_PER_HOST', 8)),
+                timeout=aiohttp.ClientTimeout(total=getattr(ajenga.config, 'MEDIA_FETCH_TIMEOUT', 60.)))
+        return self._session
+
+    async def fetch(self, url: str, directory: str, suffix: Callable[[bytes], str]) -> str:
+        """Download a url into a directory
+
+        :param url: Url
+        :param directory: Existing directory to save into
+        :param suffix: Gets file suffix like '.png' from the head of content
+        :return: Path of the saved file named by md5 of content
+        """
+        key = url, directory
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = asyncio.ensure_future(self._fetch(url, directory, suffix))
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _fetch(self, url: str, directory: str, suffix: Callable[[bytes], str]) -> str:
+        loop = asyncio.get_event_loop()
+        md5 = hashlib.md5()
+        head = b''
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                os.fchmod(f.fileno(), _FILE_MODE)
+                async with self._get_session().get(url) as resp:
+                    resp.raise_for_status()
+                    async for chunk in resp.content.iter_chunked(_CHUNK_SIZE):
+                        if len(head) < _HEAD_SIZE:
+                            head += chunk[:_HEAD_SIZE - len(head)]
+                        await loop.run_in_executor(None, _write_chunk, f, md5, chunk)
+            path = os.path.join(directory, f'{md5.hexdigest()}{suffix(head)}')
+            os.replace(temp_path, path)
+            return path
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+media_fetcher = MediaFetcher()
+
+
+@app.on_shutdown
+async def _close_media_fetcher():
+    try:
+        await media_fetcher.close()
+    except Exception as e:
+        logger.exception(e)
@@ -1,11 +1,13 @@
 import hashlib
 import imghdr
+import os
 
 import aiofiles
-import aiohttp
 from ajenga.message import Image, Voice
+from ajenga.typing import Optional, Tuple
 
-from . import ensure_file_path
+from . import ensure_file_path, get_current_plugin
+from .media import media_fetcher
 
 
 def gen_image_filename(image: Image) -> str:
@@ -14,49 +16,45 @@ def gen_image_filename(image: Image) -> str:
     return f'{md5}.{imghdr.what(None, h=image.content)}'
 
 
-async def save_image(pl, image: Image, dtype, *paths) -> Image:
-    assert image.url
-    async with aiohttp.request("GET", image.url) as resp:
-        content = await resp.content.read()
-        image.content = content
+def gen_voice_filename(voice: Voice) -> str:
+    assert voice.content
+    md5 = hashlib.md5(voice.content).hexdigest()
+    return f'{md5}.amr'
 
-    filename = gen_image_filename(image)
 
-    async with aiofiles.open(ensure_file_path(pl, dtype, *paths, filename),
-                             'wb+') as f:
-        await f.write(content)
+async def _save_media(pl, url: str, dtype, paths, suffix, content: bool) -> Tuple[str, str, Optional[bytes]]:
+    # Only to create and check the directory once
+    directory = os.path.dirname(ensure_file_path(pl, dtype, *paths, '_'))
+    path = await media_fetcher.fetch(url, directory, suffix)
+    data = None
+    if content:
+        async with aiofiles.open(path, 'rb') as f:
+            data = await f.read()
+    md5 = os.path.splitext(os.path.basename(path))[0]
+    return f'file:///{os.path.abspath(path)}', md5, data
 
-    saved_image = Image(url=ensure_file_path(pl,
-                                             dtype,
-                                             *paths,
-                                             filename,
-                                             as_url=True),
-                        content=content)
-    return saved_image
 
+async def save_image(pl, image: Image, dtype, *paths, content: bool = True) -> Image:
+    """Download an image into plugin files named by md5 of its content
+
+    :param content: Also load content into the images returned and given
+    """
+    assert image.url
+    url, md5, data = await _save_media(pl or get_current_plugin(depth=2), image.url, dtype, paths,
+                                       lambda head: f'.{imghdr.what(None, h=head)}', content)
+    if content:
+        image.content = data
+    return Image(url=url, hash=md5, content=data)
 
-def gen_voice_filename(voice: Voice) -> str:
-    assert voice.content
-    md5 = hashlib.md5(voice.content).hexdigest()
-    return f'{md5}.amr'
 
+async def save_voice(pl, voice: Voice, dtype, *paths, content: bool = True) -> Voice:
+    """Download a voice into plugin files named by md5 of its content
 
-async def save_voice(pl, voice: Voice, dtype, *paths) -> Voice:
+    :param content: Also load content into the voices returned and given
+    """
     assert voice.url
-    async with aiohttp.request("GET", voice.url) as resp:
-        content = await resp.content.read()
-        voice.content = content
-
-    filename = gen_voice_filename(voice)
-
-    async with aiofiles.open(ensure_file_path(pl, dtype, *paths, filename),
-                             'wb+') as f:
-        await f.write(content)
-
-    saved_voice = Voice(url=ensure_file_path(pl,
-                                             dtype,
-                                             *paths,
-                                             filename,
-                                             as_url=True),
-                        content=content)
-    return saved_voice
+    url, md5, data = await _save_media(pl or get_current_plugin(depth=2), voice.url, dtype, paths,
+                                       lambda head: '.amr', content)
+    if content:
+        voice.content = data
+    return Voice(url=url, hash=md5, content=data)
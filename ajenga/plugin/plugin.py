@@ -1,16 +1,23 @@
+import asyncio
+import gc
 import importlib
 import inspect
 import json
 import os
 import sys
+import time
+from dataclasses import dataclass
 from types import ModuleType
+from ajenga.typing import Any
 from ajenga.typing import Dict
 from ajenga.typing import List
 from ajenga.typing import Optional
 from ajenga.typing import Set
+from ajenga.typing import Tuple
 from ajenga.typing import Union
 
 import ajenga
+from ajenga import app
 from ajenga.event import MetaEvent
 from ajenga.event import MetaEventType
 from ajenga.log import Logger
@@ -19,7 +26,14 @@ from ajenga.provider import meta_provider
 from ajenga.utils import max_instances
 from . import Service
 from . import remove_service
+from . import save_service_configs
 from . import set_current_plugin
+from . import staged_subscriptions
+from .imports import ImportRecord
+from .imports import record_imports
+from .imports import track_package
+from .imports import untrack_package
+from .scheduler import staged_jobs
 
 
 class Plugin:
@@ -46,6 +60,16 @@ class Plugin:
         self.services = {}
         self.logger = ajenga.log.get_logger(self.name)
         self.loaded = False
+        self.dependencies: List[str] = info.get('dependencies', [])
+
+        # Names of modules of the plugin package imported
+        self.modules: Set[str] = set()
+        self._resources: List[Any] = []
+
+        self.import_time = 0.
+        self.import_record: Optional[ImportRecord] = None
+        # Time spent loading service configs, see `Service.__init__`
+        self.config_load_time = 0.
 
     def load(self,
              module: ModuleType):
@@ -57,8 +81,31 @@ class Plugin:
         self.services[service.name] = service
         logger.info(f'Succeeded to load Service "{service.key}" ')
 
+    def add_resource(self, resource):
+        """Register a resource closed when the plugin unloads
+
+        :param resource: Object having `aclose` or `close`, or a callable
+        :return: The resource
+        """
+        self._resources.append(resource)
+        return resource
+
+    async def close_resources(self) -> None:
+        while self._resources:
+            resource = self._resources.pop()
+            try:
+                close = getattr(resource, 'aclose', None) or getattr(resource, 'close', None) or resource
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.exception(e)
+                logger.error(f'Failed to close resource {resource} of Plugin "{self.name}"')
+
 
 _loaded_plugins: Dict[str, Plugin] = {}
+# Plugins of module names found by `get_current_plugin`, cleared on change of plugins
+_module_plugins: Dict[str, Optional[Plugin]] = {}
 
 
 def add_plugin(plugin: Plugin, force: bool = False) -> None:
@@ -76,6 +123,7 @@ def add_plugin(plugin: Plugin, force: bool = False) -> None:
         _loaded_plugins[plugin.name] = plugin
     if plugin.path:
         _loaded_plugins[plugin.path] = plugin
+    _module_plugins.clear()
 
 
 def remove_plugin(key: Union[str, Plugin]) -> bool:
@@ -93,6 +141,7 @@ def remove_plugin(key: Union[str, Plugin]) -> bool:
         del _loaded_plugins[plugin.name]
     if plugin.path in _loaded_plugins:
         del _loaded_plugins[plugin.path]
+    _module_plugins.clear()
     return True
 
 
@@ -105,14 +154,35 @@ def get_plugin(key: str) -> Optional[Plugin]:
     return _loaded_plugins.get(key, None)
 
 
-@max_instances(1)
-async def load_plugin(*, module_path: str = None, plugin_dir: str = None) -> Optional[Plugin]:
-    """Load a Plugin by Plugin module path or Plugin directory
+@dataclass
+class PluginLoadReport:
+    module_path: str
+    plugin: Optional[Plugin] = None
+    error: Optional[str] = None
+    lazy: bool = False
 
-    :param module_path:
-    :param plugin_dir:
-    :return:
-    """
+    @property
+    def import_time(self) -> float:
+        return self.plugin.import_time if self.plugin else 0.
+
+    @property
+    def config_load_time(self) -> float:
+        return self.plugin.config_load_time if self.plugin else 0.
+
+    def slowest_modules(self, n: int = 5) -> List[Tuple[str, float]]:
+        return self.plugin.import_record.slowest(n) if self.plugin and self.plugin.import_record else []
+
+    def __str__(self):
+        if self.error:
+            return f'{self.module_path}: failed, {self.error}'
+        if self.lazy:
+            return f'{self.module_path}: lazy'
+        slowest = ', '.join(f'{name} {t:.3f}s' for name, t in self.slowest_modules(3))
+        return (f'{self.module_path}: import {self.import_time:.3f}s, '
+                f'service config {self.config_load_time:.3f}s, slowest [{slowest}]')
+
+
+def _resolve_plugin_path(module_path: Optional[str], plugin_dir: Optional[str]) -> Tuple[str, str]:
     if not plugin_dir:
         if not module_path:
             raise ValueError()
@@ -121,17 +191,36 @@ async def load_plugin(*, module_path: str = None, plugin_dir: str = None) -> Opt
         else:
             plugin_dir = './' + module_path.replace('.', '/')
     else:
-        if plugin_dir.startswith('.'):
-            module_path = plugin_dir.replace('/', '.')[1:]
-        else:
-            module_path = plugin_dir.replace('/', '.')
+        # Both './plugins/foo' and 'plugins/foo/' are module plugins.foo
+        module_path = os.path.normpath(plugin_dir).replace(os.sep, '.').replace('/', '.')
+    # Relative module paths cannot be imported without a package
+    return module_path.lstrip('.'), plugin_dir
+
+
+def _read_plugin_info(plugin_dir: str) -> Dict:
+    plugin_info_path = os.path.join(os.path.expanduser(plugin_dir), ajenga.config.PLUGIN_INFO_FILE)
+    with open(plugin_info_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _exec_plugin_module(plugin: Plugin, module_path: str) -> ModuleType:
+    """Import and load the module of a plugin, tracking its package modules and timing the import"""
+    plugin.modules = track_package(module_path)
+    start = time.perf_counter()
+    with record_imports() as record:
+        module = importlib.import_module(module_path)
+    plugin.import_time = time.perf_counter() - start
+    plugin.import_record = record
+    plugin.load(module)
+    return module
+
 
+async def _import_plugin(module_path: str, plugin_dir: str, plugin_info: Dict = None) -> Optional[Plugin]:
     logger.info(f'Loading Plugin {module_path} from {plugin_dir} ...')
 
     try:
-        plugin_info_path = os.path.join(os.path.expanduser(plugin_dir), ajenga.config.PLUGIN_INFO_FILE)
-        with open(plugin_info_path, encoding='utf-8') as f:
-            plugin_info = json.load(f)
+        if plugin_info is None:
+            plugin_info = _read_plugin_info(plugin_dir)
 
         if plugin_info.get('name') and get_plugin(plugin_info['name']):
             logger.error(f'Plugin {plugin_info["name"]} already exists')
@@ -145,22 +234,141 @@ async def load_plugin(*, module_path: str = None, plugin_dir: str = None) -> Opt
         return None
 
     try:
-        module = importlib.import_module(module_path)
-        plugin.load(module)
+        _exec_plugin_module(plugin, module_path)
         add_plugin(plugin, True)
     except Exception as e:
         logger.exception(e)
         logger.error(f'Failed to load Plugin module from {module_path}')
         await unload_plugin(plugin, True)
         return None
+    return plugin
+
 
+async def _start_plugin(plugin: Plugin) -> None:
     await meta_provider.send(MetaEvent(MetaEventType.PluginLoad, plugin=plugin))
     meta_provider.send_nowait(MetaEvent(MetaEventType.PluginLoaded, plugin=plugin))
 
-    logger.info(f'Succeeded to load Plugin "{plugin.name}"')
+    logger.info(f'Succeeded to load Plugin "{plugin.name}" in {plugin.import_time:.3f}s')
+
+
+@max_instances(1)
+async def load_plugin(*, module_path: str = None, plugin_dir: str = None) -> Optional[Plugin]:
+    """Load a Plugin by Plugin module path or Plugin directory
+
+    :param module_path:
+    :param plugin_dir:
+    :return:
+    """
+    module_path, plugin_dir = _resolve_plugin_path(module_path, plugin_dir)
+    plugin = await _import_plugin(module_path, plugin_dir)
+    if plugin:
+        await _start_plugin(plugin)
     return plugin
 
 
+def _resolve_load_order(infos: Dict[str, Dict]) -> Tuple[List[List[str]], Dict[str, str]]:
+    """Group plugins into levels whose dependencies are all in former levels
+
+    :param infos: Dict of plugin dir to plugin info
+    :return: Levels of plugin dirs, and errors of plugin dirs which cannot be loaded
+    """
+    names = {info.get('name'): plugin_dir for plugin_dir, info in infos.items()}
+    errors = {}
+    deps = {}
+    for plugin_dir, info in infos.items():
+        deps[plugin_dir] = set()
+        for dep in info.get('dependencies', []):
+            if dep in names:
+                deps[plugin_dir].add(names[dep])
+            elif not get_plugin(dep):
+                errors[plugin_dir] = f'dependency {dep} not found'
+
+    levels = []
+    done = set()
+    left = [plugin_dir for plugin_dir in infos if plugin_dir not in errors]
+    while left:
+        level = [plugin_dir for plugin_dir in left if deps[plugin_dir] <= done]
+        if not level:
+            for plugin_dir in left:
+                errors[plugin_dir] = 'circular or failed dependency'
+            break
+        levels.append(level)
+        done.update(level)
+        left = [plugin_dir for plugin_dir in left if plugin_dir not in done]
+    return levels, errors
+
+
+@max_instances(1)
+async def load_plugins(plugin_dir: str = None) -> List[PluginLoadReport]:
+    """Load all Plugins in a directory in dependency order
+
+    Manifests are read up front, plugins list names of plugins they depend on
+    in "dependencies". Modules are imported one by one since plugins register
+    themselves through global state, while load events of plugins independent
+    of each other are handled concurrently.
+
+    Plugins with "lazy" set are only imported when an event matches their
+    "triggers", see `LazyPlugin`, unless other plugins depend on them.
+
+    :param plugin_dir: Directory containing Plugin directories, PLUGIN_DIR if None
+    :return: Load reports ordered by import time, slowest first
+    """
+    plugin_dir = (plugin_dir or ajenga.config.PLUGIN_DIR).rstrip('/')
+    reports: Dict[str, PluginLoadReport] = {}
+    infos = {}
+    for entry in sorted(os.listdir(os.path.expanduser(plugin_dir))):
+        sub_dir = f'{plugin_dir}/{entry}'
+        if not os.path.isfile(os.path.join(os.path.expanduser(sub_dir), ajenga.config.PLUGIN_INFO_FILE)):
+            continue
+        module_path, sub_dir = _resolve_plugin_path(None, sub_dir)
+        reports[sub_dir] = PluginLoadReport(module_path)
+        try:
+            infos[sub_dir] = _read_plugin_info(sub_dir)
+        except Exception as e:
+            logger.exception(e)
+            reports[sub_dir].error = f'invalid plugin info: {e}'
+
+    from .lazy import add_lazy_plugin
+
+    levels, errors = _resolve_load_order(infos)
+    required = set(dep for info in infos.values() for dep in info.get('dependencies', []))
+    for sub_dir, error in errors.items():
+        reports[sub_dir].error = error
+        logger.error(f'Cannot load Plugin from {sub_dir}: {error}')
+
+    start = time.perf_counter()
+    failed = set()
+    for level in levels:
+        plugins = []
+        for sub_dir in level:
+            report = reports[sub_dir]
+            failed_deps = [dep for dep in infos[sub_dir].get('dependencies', []) if dep in failed]
+            if failed_deps:
+                report.error = f'dependencies {failed_deps} failed'
+            elif infos[sub_dir].get('lazy') and infos[sub_dir].get('name') not in required:
+                report.lazy = True
+                if not add_lazy_plugin(report.module_path, sub_dir, infos[sub_dir]):
+                    report.error = 'lazy registration failed'
+                    failed.add(infos[sub_dir].get('name'))
+                continue
+            else:
+                report.plugin = await _import_plugin(report.module_path, sub_dir, infos[sub_dir])
+                if report.plugin is None:
+                    report.error = report.error or 'import failed'
+            if report.error:
+                failed.add(infos[sub_dir].get('name'))
+            else:
+                plugins.append(report.plugin)
+        await asyncio.gather(*map(_start_plugin, plugins))
+
+    result = sorted(reports.values(), key=lambda r: r.import_time, reverse=True)
+    logger.info(f'Loaded {sum(not r.error for r in result)}/{len(result)} Plugins '
+                f'in {time.perf_counter() - start:.3f}s')
+    for report in result:
+        logger.info(str(report))
+    return result
+
+
 @max_instances(1)
 async def unload_plugin(key: Union[str, Plugin], forced: bool = False) -> bool:
     """Unload a Plugin
@@ -175,11 +383,18 @@ async def unload_plugin(key: Union[str, Plugin], forced: bool = False) -> bool:
         return False
 
     plugin_name = plugin.name
+    # Measuring reclaimed memory forces full collections, only done for debugging
+    measure = getattr(ajenga.config, 'PLUGIN_UNLOAD_MEASURE', False)
+    if measure:
+        gc.collect()
+        blocks = sys.getallocatedblocks()
 
     await meta_provider.send(MetaEvent(MetaEventType.PluginUnload, plugin=plugin))
 
     for service in plugin.services.values():
         try:
+            # In case unload handlers failed
+            service.release()
             remove_service(service)
         except Exception as e:
             logger.exception(e)
@@ -189,20 +404,36 @@ async def unload_plugin(key: Union[str, Plugin], forced: bool = False) -> bool:
     if not result and not forced:
         return False
 
+    await plugin.close_resources()
+
     if plugin.path:
-        for module in list(filter(lambda x: x.startswith(plugin.path), sys.modules.keys())):
-            del sys.modules[module]
+        # Only modules of the plugin package recorded on import
+        for module in untrack_package(plugin.path) | {plugin.path}:
+            sys.modules.pop(module, None)
+        plugin.modules = set()
+    plugin.module = None
+    plugin.services.clear()
 
     meta_provider.send_nowait(MetaEvent(MetaEventType.PluginUnloaded, plugin=plugin))
 
     logger.info(f'Succeeded to unload Plugin "{plugin_name}"')
+    if measure:
+        gc.collect()
+        logger.debug(f'Unloading Plugin "{plugin_name}" reclaimed {blocks - sys.getallocatedblocks()} memory blocks')
     return True
 
 
-async def reload_plugin(key: Union[str, Plugin]) -> Optional[Plugin]:
+async def reload_plugin(key: Union[str, Plugin], atomic: bool = True) -> Optional[Plugin]:
     """Reload a Plugin
 
+    The new version is imported alongside the old one with its handlers and
+    scheduled jobs held back, then handlers are swapped and jobs resumed in
+    one step so no event misses the plugin.
+    The old version is kept if the import fails. Waits of the old version
+    keep their own subscriptions and drain as usual.
+
     :param key: Plugin object or module path or name
+    :param atomic: Swap handlers atomically, or unload then load if False
     :return: Success or not
     """
     plugin = get_plugin(key) if isinstance(key, str) else key
@@ -211,7 +442,85 @@ async def reload_plugin(key: Union[str, Plugin]) -> Optional[Plugin]:
         return None
 
     module_path = plugin.path
-    return await load_plugin(module_path=module_path) if await unload_plugin(plugin) else None
+    if not atomic:
+        return await load_plugin(module_path=module_path) if await unload_plugin(plugin) else None
+
+    start = time.perf_counter()
+    dropped = app.pipeline.stats.dropped
+    module_path, plugin_dir = _resolve_plugin_path(module_path, None)
+    try:
+        new_plugin = Plugin(_read_plugin_info(plugin_dir), path=module_path)
+    except Exception as e:
+        logger.exception(e)
+        logger.error(f'Failed to reload Plugin config from {plugin_dir}')
+        return None
+    # New services load the latest configs
+    await save_service_configs()
+
+    # Stash old modules so they are restored if the new version fails
+    old_tracked = untrack_package(module_path)
+    stashed = {name: sys.modules.pop(name) for name in old_tracked | {module_path} if name in sys.modules}
+    set_current_plugin(new_plugin)
+    # Code of the new version resolves its own plugin while importing,
+    # handlers of the old version cannot run meanwhile as nothing is awaited
+    _loaded_plugins[module_path] = new_plugin
+    _module_plugins.clear()
+    with staged_subscriptions() as graphs, staged_jobs() as jobs:
+        try:
+            module = _exec_plugin_module(new_plugin, module_path)
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'Failed to reload Plugin module from {module_path}, keeping the old version')
+            for service in new_plugin.services.values():
+                # Handlers never subscribed
+                service._terminals.clear()
+                service.release()
+                remove_service(service)
+            for service in plugin.services.values():
+                service.restore()
+            for name in untrack_package(module_path):
+                sys.modules.pop(name, None)
+            sys.modules.update(stashed)
+            track_package(module_path).update(old_tracked)
+            _loaded_plugins[module_path] = plugin
+            _module_plugins.clear()
+            module = None
+    if module is None:
+        await new_plugin.close_resources()
+        return None
+
+    # Swap handlers and registry without awaiting in between
+    for service in plugin.services.values():
+        service.detach()
+    for graph in graphs:
+        app.engine.subscribe(graph)
+    if _loaded_plugins.get(plugin.name) is plugin:
+        del _loaded_plugins[plugin.name]
+    add_plugin(new_plugin, True)
+    for job in jobs:
+        try:
+            job.resume()
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'Failed to resume job {job.id} of Plugin "{new_plugin.name}"')
+
+    # Old handlers of PluginUnload release old services
+    await meta_provider.send(MetaEvent(MetaEventType.PluginUnload, plugin=plugin))
+    for service in plugin.services.values():
+        try:
+            service.release()
+            remove_service(service)
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'Failed to unload service "{service}", error: {e}')
+    await plugin.close_resources()
+    plugin.module = None
+    meta_provider.send_nowait(MetaEvent(MetaEventType.PluginUnloaded, plugin=plugin))
+
+    await _start_plugin(new_plugin)
+    logger.info(f'Reloaded Plugin "{new_plugin.name}" in {time.perf_counter() - start:.3f}s, '
+                f'{app.pipeline.stats.dropped - dropped} events dropped by the pipeline meanwhile')
+    return new_plugin
 
 
 def get_loaded_plugins() -> Set[Plugin]:
@@ -222,28 +531,29 @@ def get_loaded_plugins() -> Set[Plugin]:
     return set(_loaded_plugins.values())
 
 
-def caller_name(skip):
-    def stack_(frame):
-        frame_list = []
-        while frame:
-            frame_list.append(frame)
-            frame = frame.f_back
-        return frame_list
+def _caller_module_name(depth: int) -> Optional[str]:
+    try:
+        # Frame of the caller of our caller at depth 1
+        return sys._getframe(depth + 1).f_globals.get('__name__')
+    except ValueError:
+        return None
 
-    stack = stack_(sys._getframe(1))
-    start = 0 + skip
-    if len(stack) < start + 1:
-        return ''
-    parent_frame = stack[start]
 
-    module = inspect.getmodule(parent_frame)
+def caller_name(skip):
+    module_name = _caller_module_name(skip + 1)
+    return sys.modules.get(module_name) if module_name else ''
 
-    return module
 
+def _find_plugin(module_name: str) -> Optional[Plugin]:
+    if module_name in _module_plugins:
+        return _module_plugins[module_name]
+    name = module_name
+    while not get_plugin(name) and '.' in name:
+        name, _ = name.rsplit('.', maxsplit=1)
+    plugin = _module_plugins[module_name] = get_plugin(name)
+    return plugin
 
-def get_current_plugin(*, depth=1) -> Optional[Plugin]:
-    module_name = caller_name(depth).__name__
-    while not get_plugin(module_name) and '.' in module_name:
-        module_name, _ = module_name.rsplit('.', maxsplit=1)
 
-    return get_plugin(module_name)
+def get_current_plugin(*, depth=1) -> Optional[Plugin]:
+    module_name = _caller_module_name(depth)
+    return _find_plugin(module_name) if module_name else None
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import ajenga
+import ajenga.router as router
+from ajenga import app
+from ajenga.event import Event, EventType
+from ajenga.log import logger
+from ajenga.models import ContactIdType
+from ajenga.models.contact import Group
+from ajenga.provider import BotSession
+from ajenga.router import std
+from ajenga.router.models import Priority
+from ajenga.typing import Dict, List, Optional, Tuple
+
+
+class GroupRoster:
+    """Group lists of all bot sessions cached for a TTL
+
+    Sessions are fetched concurrently, and concurrent callers share one
+    in-flight request per session. A session is refreshed on its next use
+    after joining or leaving a group.
+    """
+
+    def __init__(self, ttl: float = None):
+        self._ttl = ttl
+        self._groups: Dict[ContactIdType, Tuple[float, List[Group]]] = {}
+        self._pending: Dict[ContactIdType, asyncio.Future] = {}
+        # Bumped on invalidation so in-flight results are not cached
+        self._versions: Dict[ContactIdType, int] = {}
+
+    @property
+    def ttl(self) -> float:
+        return getattr(ajenga.config, 'GROUP_ROSTER_TTL', 300.) if self._ttl is None else self._ttl
+
+    async def get(self, qq: ContactIdType, session: BotSession = None) -> List[Group]:
+        """Get group list of a bot session
+
+        :param qq: Bot qq
+        :param session: Bot session, looked up by qq if not given
+        :return: List of groups, empty if failed
+        """
+        cached = self._groups.get(qq)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        pending = self._pending.get(qq)
+        if pending is None:
+            session = session or app.get_session(qq)
+            if session is None:
+                return []
+            pending = self._pending[qq] = asyncio.ensure_future(self._fetch(qq, session))
+            pending.add_done_callback(lambda _: self._pending.pop(qq, None))
+        return await asyncio.shield(pending)
+
+    async def get_all(self) -> Dict[ContactIdType, List[Group]]:
+        """Get group lists of all bot sessions
+
+        :return: Dict of bot qq to list of groups
+        """
+        sessions = app.get_sessions()
+        results = await asyncio.gather(*(self.get(qq, ses) for qq, ses in sessions.items()))
+        return dict(zip(sessions, results))
+
+    async def _fetch(self, qq: ContactIdType, session: BotSession) -> List[Group]:
+        expires = time.monotonic() + self.ttl
+        version = self._versions.get(qq, 0)
+        try:
+            result = await session.api.get_group_list()
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'Failed to get group list of {qq}')
+            return []
+        if not result.ok:
+            logger.error(f'Failed to get group list of {qq}: {result.message}')
+            return []
+        if self._versions.get(qq, 0) == version:
+            self._groups[qq] = expires, result.data
+        return result.data
+
+    def invalidate(self, qq: Optional[ContactIdType] = None) -> None:
+        """Drop cached group list of a bot, or of all bots if qq is None"""
+        for qq in list(self._groups) + list(self._pending) if qq is None else [qq]:
+            self._groups.pop(qq, None)
+            self._versions[qq] = self._versions.get(qq, 0) + 1
+
+
+group_roster = GroupRoster()
+
+
+@app.on(router.event_type_is(EventType.GroupJoin, EventType.GroupLeave, EventType.GroupInvitedRequest))
+@std.handler(priority=Priority.Wakeup, count_finished=False)
+async def _invalidate_roster(event: Event, source):
+    qq = getattr(source, 'qq', None)
+    if qq is None:
+        return
+    # Member changes of other accounts do not change the roster
+    if event.type == EventType.GroupInvitedRequest or event.qq == qq:
+        group_roster.invalidate(qq)
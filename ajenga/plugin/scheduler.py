@@ -0,0 +1,157 @@
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+
+from apscheduler.events import (EVENT_JOB_ERROR, EVENT_JOB_EXECUTED,
+                                EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED,
+                                JobEvent)
+from apscheduler.job import Job
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+import ajenga
+from ajenga.typing import Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class JobStats:
+    runs: int = 0
+    errors: int = 0
+    missed: int = 0
+    total_lateness: float = 0.
+    max_lateness: float = 0.
+    total_duration: float = 0.
+    max_duration: float = 0.
+
+    @property
+    def average_lateness(self) -> float:
+        return self.total_lateness / self.runs if self.runs else 0.
+
+    @property
+    def average_duration(self) -> float:
+        return self.total_duration / self.runs if self.runs else 0.
+
+
+_scheduler: Optional[AsyncIOScheduler] = None
+_job_stats: Dict[str, JobStats] = {}
+# Monotonic submit time and lateness of runs not finished yet
+_submitted: Dict[Tuple[str, datetime], Tuple[float, float]] = {}
+
+
+def _on_job_event(event: JobEvent):
+    stats = _job_stats.get(event.job_id)
+    if stats is None:
+        stats = _job_stats[event.job_id] = JobStats()
+    if event.code == EVENT_JOB_SUBMITTED:
+        now = time.monotonic()
+        for run_time in event.scheduled_run_times:
+            lateness = (datetime.now(run_time.tzinfo) - run_time).total_seconds()
+            _submitted[event.job_id, run_time] = now, lateness
+    elif event.code == EVENT_JOB_MISSED:
+        stats.missed += 1
+        _submitted.pop((event.job_id, event.scheduled_run_time), None)
+    else:
+        submitted = _submitted.pop((event.job_id, event.scheduled_run_time), None)
+        stats.runs += 1
+        if event.code == EVENT_JOB_ERROR:
+            stats.errors += 1
+        if submitted:
+            start, lateness = submitted
+            duration = time.monotonic() - start
+            stats.total_lateness += lateness
+            stats.max_lateness = max(stats.max_lateness, lateness)
+            stats.total_duration += duration
+            stats.max_duration = max(stats.max_duration, duration)
+
+
+# Jobs added paused while staging, see `staged_jobs`
+_staged_jobs: Optional[List[Job]] = None
+
+
+class staged_jobs:
+    """Context manager holding back jobs of services added inside
+
+    Jobs are added paused and resumed by the caller with `Job.resume`, e.g.
+    once handlers of a reloaded plugin are swapped in.
+    """
+
+    def __enter__(self) -> List[Job]:
+        global _staged_jobs
+        if _staged_jobs is not None:
+            raise RuntimeError('Jobs are being staged')
+        _staged_jobs = []
+        return _staged_jobs
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _staged_jobs
+        _staged_jobs = None
+
+
+def get_scheduler() -> AsyncIOScheduler:
+    """Get the scheduler shared by all services"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = AsyncIOScheduler()
+        _scheduler.configure(ajenga.config.APSCHEDULER_CONFIG)
+        _scheduler.add_listener(
+            _on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+    return _scheduler
+
+
+class ServiceScheduler:
+    """Jobs of a service in the shared scheduler
+
+    Job ids are prefixed by the namespace of the service, so jobs of a
+    service can be listed and removed together.
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = f'{namespace}:{uuid.uuid4().hex[:8]}'
+        self._prefix = self.namespace + ':'
+
+    @property
+    def running(self) -> bool:
+        return get_scheduler().running
+
+    def start(self) -> None:
+        """Start the shared scheduler if not running"""
+        scheduler = get_scheduler()
+        if not scheduler.running:
+            scheduler.start()
+
+    def add_job(self, func: Callable, trigger=None, args=None, kwargs=None, id: str = None, **options) -> Job:
+        """Same as `AsyncIOScheduler.add_job`, with id in the namespace"""
+        if _staged_jobs is not None:
+            options['next_run_time'] = None
+        job = get_scheduler().add_job(
+            func, trigger, args, kwargs, id=self._prefix + (id or uuid.uuid4().hex), **options)
+        if _staged_jobs is not None:
+            _staged_jobs.append(job)
+        return job
+
+    def scheduled_job(self, trigger, args=None, kwargs=None, id: str = None, **options) -> Callable:
+        def deco(func: Callable) -> Callable:
+            self.add_job(func, trigger, args, kwargs, id=id, **options)
+            return func
+
+        return deco
+
+    def get_job(self, id: str) -> Optional[Job]:
+        return get_scheduler().get_job(self._prefix + id)
+
+    def get_jobs(self) -> List[Job]:
+        return [job for job in get_scheduler().get_jobs() if job.id.startswith(self._prefix)]
+
+    def remove_job(self, id: str) -> None:
+        get_scheduler().remove_job(self._prefix + id)
+        _job_stats.pop(self._prefix + id, None)
+
+    def remove_all_jobs(self) -> None:
+        for job in self.get_jobs():
+            job.remove()
+            _job_stats.pop(job.id, None)
+
+    def get_stats(self) -> Dict[str, JobStats]:
+        """Get run metrics of jobs, keyed by job id without namespace"""
+        return {job_id[len(self._prefix):]: stats for job_id, stats in _job_stats.items()
+                if job_id.startswith(self._prefix)}
@@ -1,13 +1,14 @@
 import asyncio
-import json
+import atexit
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import wraps
 
 import pytz
-from apscheduler.schedulers.asyncio import AsyncIOScheduler as Scheduler
 
 import ajenga
 import ajenga.router as router
@@ -21,10 +22,19 @@ from ajenga.models import ContactIdType
 from ajenga.protocol import Api
 from ajenga.router import std
 from ajenga.router.keyfunc import PredicateFunction
-from ajenga.router.models import Graph, TerminalNode
-from ajenga.router.std import PredicateNode
-from ajenga.typing import (TYPE_CHECKING, Any, Callable, Dict, Optional, Set,
-                           Union, final)
+from ajenga.router.keystore import KeyStore
+from ajenga.router.models import (Graph, NonterminalNode, RouteResult_T,
+                                  TerminalNode)
+from ajenga.router.state import RouteState
+from ajenga.router.std import AbsNonterminalNode, PredicateNode, make_graph_deco
+from ajenga.typing import (TYPE_CHECKING, Any, Callable, Dict, FrozenSet,
+                           Iterable, List, Optional, Set, Union, final)
+
+from .blacklist import Blacklist
+from .broadcast import BroadcastTask
+from .roster import group_roster
+from .scheduler import ServiceScheduler
+from .store import ServiceConfigStore
 
 if TYPE_CHECKING:
     from .plugin import Plugin
@@ -35,41 +45,130 @@ _tmp_current_plugin: Optional["Plugin"] = None
 _service_config_dir = os.path.expanduser('./service_config/')
 os.makedirs(_service_config_dir, exist_ok=True)
 
-# block list
-_black_list_group = {}  # Dict[group, expr_time]
-_black_list_user = {}  # Dict[qq, expr_time]
+_config_store: Optional[ServiceConfigStore] = None
+
+
+def _get_config_store() -> ServiceConfigStore:
+    global _config_store
+    if _config_store is None:
+        _config_store = ServiceConfigStore(os.path.expanduser(
+            getattr(ajenga.config, 'SERVICE_CONFIG_DB', os.path.join(_service_config_dir, 'services.db'))))
+        _config_store.migrate_json(_service_config_dir)
+    return _config_store
 
 
 def _load_service_config(service_key):
-    config_file = os.path.join(_service_config_dir, f'{service_key}.json')
-    if not os.path.exists(config_file):
-        return {}  # config file not found, return default config.
     try:
-        with open(config_file, encoding='utf8') as f:
-            config = json.load(f)
-            return config
+        return _get_config_store().load(service_key)
     except Exception as e:
         logger.exception(e)
-        return {}
+        return {}  # fallback to default config.
+
+
+def _dump_service_config(service) -> dict:
+    return {
+        "name": service.name,
+        "use_priv": service.use_priv,
+        "manage_priv": service.manage_priv,
+        "enable_on_default": service.enable_on_default,
+        "visible": service.visible,
+        "enable_group": list(service.enable_group),
+        "disable_group": list(service.disable_group),
+        'user_privs': list(service.user_privs.items())
+    }
+
+
+def _write_service_configs(configs: Dict[str, dict]):
+    try:
+        _get_config_store().save(configs)
+    except Exception as e:
+        logger.exception(e)
+        logger.error(f'Failed to save config of services {list(configs)}')
+
+
+class _ConfigWriter:
+    """Write-behind saving of service configs
+
+    Changed services are marked dirty and flushed together after a delay or
+    after enough changes. Configs are snapshotted on the event loop and
+    written to the config store by a single background thread, so writes
+    keep their order.
+    """
+
+    def __init__(self):
+        self._dirty: Dict[str, "Service"] = {}
+        self._changes = 0
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='service_config')
+
+    def mark(self, service: "Service"):
+        self._dirty[service.key] = service
+        self._changes += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync()
+            return
+        if self._changes >= getattr(ajenga.config, 'SERVICE_CONFIG_FLUSH_CHANGES', 100):
+            self.flush()
+        elif self._handle is None:
+            self._handle = loop.call_later(
+                getattr(ajenga.config, 'SERVICE_CONFIG_FLUSH_DELAY', 5.), self.flush)
+
+    def _take(self) -> Dict[str, dict]:
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        configs = {key: _dump_service_config(service) for key, service in self._dirty.items()}
+        self._dirty.clear()
+        self._changes = 0
+        return configs
+
+    def flush(self) -> "asyncio.Future":
+        """Write all dirty configs in background
+
+        :return: Future done when written
+        """
+        return asyncio.get_event_loop().run_in_executor(
+            self._executor, _write_service_configs, self._take())
+
+    def submit(self, func: Callable, *args) -> None:
+        """Run a store write in the writer thread, after writes queued before"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            func(*args)
+        else:
+            self._executor.submit(func, *args)
+
+    def flush_sync(self):
+        configs = self._take()
+        try:
+            # Let queued writes finish first
+            self._executor.submit(int).result()
+        except RuntimeError:
+            pass  # Executor is shut down on interpreter exit
+        if configs:
+            _write_service_configs(configs)
+
+
+_config_writer = _ConfigWriter()
+app.on_shutdown(lambda: _config_writer.flush())
+atexit.register(_config_writer.flush_sync)
 
 
 def _save_service_config(service):
-    config_file = os.path.join(_service_config_dir, f'{service.key}.json')
-    with open(config_file, 'w', encoding='utf8') as f:
-        json.dump(
-            {
-                "name": service.name,
-                "use_priv": service.use_priv,
-                "manage_priv": service.manage_priv,
-                "enable_on_default": service.enable_on_default,
-                "visible": service.visible,
-                "enable_group": list(service.enable_group),
-                "disable_group": list(service.disable_group),
-                'user_privs': list(service.user_privs.items())
-            },
-            f,
-            ensure_ascii=False,
-            indent=2)
+    _config_writer.mark(service)
+
+
+async def save_service_configs() -> None:
+    """Save changed service configs now"""
+    await _config_writer.flush()
+
+
+# block list
+_black_list_group = Blacklist('group', _get_config_store, _config_writer.submit)
+_black_list_user = Blacklist('user', _get_config_store, _config_writer.submit)
 
 
 class Privilege:
@@ -90,6 +189,138 @@ class Privilege:
     NOBODY = 1000
 
 
+# Route store keys of values cached per event
+_EVENT_PRIV_KEY = '_service_event_priv'
+_ENABLED_MASK_KEY = '_service_enabled_mask'
+
+
+class _EnableIndex:
+    """Bitmask index of services enabled in groups
+
+    Each loaded service owns a bit, so services enabled in a group are given
+    by one mask computed from defaults and per group overrides.
+    """
+
+    def __init__(self):
+        self._bits: Dict["Service", int] = {}
+        self._services: Dict[int, "Service"] = {}
+        self._free: List[int] = []
+        self._default = 0
+        self._enabled: Dict[ContactIdType, int] = {}
+        self._disabled: Dict[ContactIdType, int] = {}
+
+    def add(self, service: "Service") -> None:
+        # Bits freed are cleared on removal, so a new service only sets its bit
+        bit = self._free.pop() if self._free else len(self._bits)
+        self._bits[service] = bit
+        self._services[bit] = service
+        self._set_bits(service, bit)
+
+    def remove(self, service: "Service") -> None:
+        bit = self._bits.pop(service, None)
+        if bit is None:
+            return
+        del self._services[bit]
+        self._clear(bit)
+        self._free.append(bit)
+
+    def update(self, service: "Service") -> None:
+        """Rebuild bits of a service from its config"""
+        bit = self._bits.get(service)
+        if bit is None:
+            return  # Released
+        self._clear(bit)
+        self._set_bits(service, bit)
+
+    def _set_bits(self, service: "Service", bit: int):
+        if service._enable_on_default:
+            self._default |= 1 << bit
+        for group in service._enable_group:
+            self._enabled[group] = self._enabled.get(group, 0) | 1 << bit
+        for group in service._disable_group:
+            self._disabled[group] = self._disabled.get(group, 0) | 1 << bit
+
+    def set(self, service: "Service", group: ContactIdType, enabled: bool) -> None:
+        bit = self._bits.get(service)
+        if bit is None:
+            return  # Released
+        mask = 1 << bit
+        on, off = (self._enabled, self._disabled) if enabled else (self._disabled, self._enabled)
+        on[group] = on.get(group, 0) | mask
+        if off.get(group, 0) & ~mask:
+            off[group] &= ~mask
+        else:
+            off.pop(group, None)
+
+    def _clear(self, bit: int):
+        mask = ~(1 << bit)
+        self._default &= mask
+        for masks in (self._enabled, self._disabled):
+            for group in [group for group, value in masks.items() if not value & mask]:
+                del masks[group]
+            for group in masks:
+                masks[group] &= mask
+
+    def bit(self, service: "Service") -> Optional[int]:
+        """Get bit of a service, None if released"""
+        return self._bits.get(service)
+
+    def mask(self, group: ContactIdType) -> int:
+        return (self._default & ~self._disabled.get(group, 0)) | self._enabled.get(group, 0)
+
+    def services(self, group: ContactIdType) -> Set["Service"]:
+        mask = self.mask(group)
+        return set(service for bit, service in self._services.items() if mask >> bit & 1)
+
+
+_enable_index = _EnableIndex()
+
+
+@final
+class _ServiceNode(AbsNonterminalNode):
+    """Route only to services enabled in the group of a group message
+
+    Placed after the keyed nodes of service graphs, so those still merge
+    across services, and before privilege checks. Handlers reached of
+    services disabled in the group are dropped by one mask lookup per event.
+    """
+
+    def __init__(self, service: "Service" = ..., *or_more: "Service"):
+        super().__init__()
+        if service is not ...:
+            self.add_key(service)
+        for more in or_more:
+            self.add_key(more)
+
+    async def _route(self, state: RouteState) -> Set[RouteResult_T]:
+        event = state.store['event']
+        if isinstance(event, GroupMessageEvent):
+            mask = _enabled_mask(event.group, state.store)
+            nodes = set()
+            for service, successors in self._successors.items():
+                # Released services keep their keys with no successors left
+                bit = _enable_index.bit(service)
+                if successors and bit is not None and mask >> bit & 1:
+                    nodes.update(successors)
+        else:
+            nodes = set().union(*self._successors.values())
+
+        res = set()
+        for node in nodes:
+            if isinstance(node, TerminalNode):
+                res.add(state.wrap(node))
+            elif isinstance(node, NonterminalNode):
+                res |= await node.route(state)
+        return res
+
+
+def _enabled_mask(group: ContactIdType, store: KeyStore) -> int:
+    mask = store.get(_ENABLED_MASK_KEY)
+    if mask is None:
+        mask = store[_ENABLED_MASK_KEY] = _enable_index.mask(group)
+    return mask
+
+
 class SchedulerSource(EventProvider):
     pass
 
@@ -109,10 +340,12 @@ class ServiceGraphImpl(Graph):
 
     """
     sv: "Service"
+    unload: bool
 
-    def __init__(self, sv, **kwargs):
+    def __init__(self, sv, unload: bool = False, **kwargs):
         super().__init__(**kwargs)
         self.sv = sv
+        self.unload = unload
 
     def __call__(self, func) -> TerminalNode:
         if self.closed:
@@ -121,15 +354,45 @@ class ServiceGraphImpl(Graph):
             func = app.engine.handler_cls(func)
         g = self.apply(func)
         self.sv._terminals.add(func)
-        app.engine.subscribe(g)
+        if self.unload:
+            self.sv._unload_terminals.add(func)
+        self.sv._graphs.append(g)
+        if _staged_graphs is not None:
+            _staged_graphs.append(g)
+        else:
+            app.engine.subscribe(g)
         return func
 
     def copy(self):
         return ServiceGraphImpl(sv=self.sv,
+                                unload=self.unload,
                                 start=self.start.copy(),
                                 closed=self.closed)
 
 
+# Graphs held back from the engine while staging, see `staged_subscriptions`
+_staged_graphs: Optional[List[Graph]] = None
+
+
+class staged_subscriptions:
+    """Context manager holding back graphs of services created inside
+
+    The graphs collected are subscribed by the caller at once, e.g. to swap
+    handlers of a reloaded plugin without a window of missing handlers.
+    """
+
+    def __enter__(self) -> List[Graph]:
+        global _staged_graphs
+        if _staged_graphs is not None:
+            raise RuntimeError('Subscriptions are being staged')
+        _staged_graphs = []
+        return _staged_graphs
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _staged_graphs
+        _staged_graphs = None
+
+
 class Service:
     name: str
     plugin: "Plugin"
@@ -148,50 +411,50 @@ class Service:
         self.plugin = _tmp_current_plugin
         self.logger = self.plugin.logger.getChild(self.name)
 
+        start = time.perf_counter()
         config = _load_service_config(self.key)
+        self.plugin.config_load_time += time.perf_counter() - start
 
         self.use_priv = config.get('use_priv', use_priv)
         self.manage_priv = config.get('manage_priv', manage_priv)
-        self.enable_on_default = config.get('enable_on_default')
-        if self.enable_on_default is None:
+        self._enable_on_default = config.get('enable_on_default')
+        if self._enable_on_default is None:
             if enable_on_default is None:
-                self.enable_on_default = name is None
+                self._enable_on_default = name is None
             else:
-                self.enable_on_default = enable_on_default
+                self._enable_on_default = enable_on_default
         self.visible = config.get('visible')
         if self.visible is None:
             if visible is None:
                 self.visible = name is not None
             else:
                 self.visible = visible
-        self.enable_group = set(config.get('enable_group', []))
-        self.disable_group = set(config.get('disable_group', []))
+        self._enable_group = set(config.get('enable_group', []))
+        self._disable_group = set(config.get('disable_group', []))
         self.user_privs = dict(config.get('user_privs', []))
+        _enable_index.add(self)
 
         # self._node_key = PredicateFunction(lambda event: self.check_priv(event), notation=self)
         # self._node = PredicateNode(self._node_key)
         self._sv_node = router.meta_plugin_is(self.plugin)
         self._terminals: Set[TerminalNode] = set()
+        # Graphs subscribed, kept to dispatch events to this service alone
+        self._graphs: List[Graph] = []
+        # Handlers of PluginUnload, kept subscribed until the plugin unloads
+        self._unload_terminals: Set[TerminalNode] = set()
 
-        self._scheduler = Scheduler()
+        self._scheduler = ServiceScheduler(self.key)
 
         @self.on_loaded()
         def _start_scheduler():
-            if self._scheduler and not self._scheduler.running and self._scheduler.get_jobs(
-            ):
-                self._scheduler.configure(ajenga.config.APSCHEDULER_CONFIG)
+            if not self._scheduler.running and self._scheduler.get_jobs():
                 self._scheduler.start()
 
+        self._released = False
+
         @self.on_unload()
         def _on_unload():
-            self.logger.info(
-                f'Unloading... Unsubscribe all {len(self._terminals)} subscribers.'
-            )
-            app.engine.unsubscribe_terminals(self._terminals)
-
-            # Stop scheduler
-            if self._scheduler and self._scheduler.running:
-                self._scheduler.remove_all_jobs()
+            self.release()
 
         # Add to service list
         if self.key in _loaded_services:
@@ -203,21 +466,38 @@ class Service:
                    event: Event,
                    required_priv: Union[int, Callable[[int], bool]] = None):
         if event.type in MessageEventTypes:
-            required_priv = self.use_priv if required_priv is None else required_priv
             user_priv = self.get_user_priv(event)
 
             if isinstance(event, GroupMessageEvent):
                 if not self.check_enabled(event.group):
                     return False
-            if isinstance(required_priv, int):
-                return bool(user_priv >= required_priv)
-            elif isinstance(required_priv, Callable):
-                return required_priv(user_priv)
-            else:
-                return False
+            return self._satisfies(user_priv, required_priv)
+        else:
+            return True
+
+    def _check_priv_cached(self,
+                           event: Event,
+                           store: KeyStore,
+                           required_priv: Union[int, Callable[[int], bool]] = None):
+        """Same as `check_priv` except enablement which is checked by `_ServiceNode`,
+        sharing service independent results in the route store"""
+        if event.type in MessageEventTypes:
+            ev_priv = store.get(_EVENT_PRIV_KEY)
+            if ev_priv is None:
+                ev_priv = store[_EVENT_PRIV_KEY] = self.get_priv_from_event(event)
+            return self._satisfies(self._merge_user_priv(event.sender.qq, ev_priv), required_priv)
         else:
             return True
 
+    def _satisfies(self, user_priv: int, required_priv: Union[int, Callable[[int], bool]] = None):
+        required_priv = self.use_priv if required_priv is None else required_priv
+        if isinstance(required_priv, int):
+            return bool(user_priv >= required_priv)
+        elif isinstance(required_priv, Callable):
+            return required_priv(user_priv)
+        else:
+            return False
+
     @property
     def key(self):
         if self.plugin is None:
@@ -228,18 +508,45 @@ class Service:
     def __str__(self):
         return f'<Service: {self.key}>'
 
+    def restore(self) -> None:
+        """Register the service again after a service replacing it is discarded"""
+        _loaded_services[self.key] = self
+
+    def detach(self) -> None:
+        """Unsubscribe handlers except those of PluginUnload"""
+        app.engine.unsubscribe_terminals(self._terminals - self._unload_terminals)
+
+    def release(self) -> None:
+        """Release routes, scheduler jobs and enablement of the service, only done once"""
+        if self._released:
+            return
+        self._released = True
+        self.logger.info(
+            f'Unloading... Unsubscribe all {len(self._terminals)} subscribers.'
+        )
+        app.engine.unsubscribe_terminals(self._terminals)
+        self._terminals.clear()
+        self._graphs.clear()
+
+        _enable_index.remove(self)
+        _config_writer.flush()
+
+        # Remove jobs from the shared scheduler
+        self._scheduler.remove_all_jobs()
+
     @property
-    def scheduler(self) -> Scheduler:
+    def scheduler(self) -> ServiceScheduler:
         return self._scheduler
 
     def on(self,
            graph=std.true,
            *,
            priv: Union[int, Callable[[int], bool]] = None):
-        return ServiceGraphImpl(self) & graph & PredicateNode(
-            PredicateFunction(
-                lambda event: self.check_priv(event, required_priv=priv),
-                notation=self))
+        def _check_priv(event, _store: KeyStore):
+            return self._check_priv_cached(event, _store, required_priv=priv)
+
+        return ServiceGraphImpl(self) & graph & make_graph_deco(_ServiceNode)(self) & PredicateNode(
+            PredicateFunction(_check_priv, notation=self))
 
     def on_message(self,
                    graph=std.true,
@@ -264,7 +571,7 @@ class Service:
             return g
 
     def on_unload(self, arg: Any = None):
-        g = (ServiceGraphImpl(self) & router.event_type_is(EventType.Meta)
+        g = (ServiceGraphImpl(self, unload=True) & router.event_type_is(EventType.Meta)
              & router.meta_type_is(MetaEventType.PluginUnload) & self._sv_node)
         if isinstance(arg, Callable):
             return g(arg)
@@ -273,18 +580,45 @@ class Service:
 
     @staticmethod
     def check_block_group(group: int):
-        if group in _black_list_group and datetime.now(
-        ) > _black_list_group[group]:
-            del _black_list_group[group]  # 拉黑时间过期
-            return False
-        return bool(group in _black_list_group)
+        return group in _black_list_group
 
     @staticmethod
     def check_block_user(qq: int):
-        if qq in _black_list_user and datetime.now() > _black_list_user[qq]:
-            del _black_list_user[qq]  # 拉黑时间过期
-            return False
-        return bool(qq in _black_list_user)
+        return qq in _black_list_user
+
+    @staticmethod
+    def set_block_group(group: Union[int, Iterable[int]], duration: Union[timedelta, float]):
+        """Block groups for a duration
+
+        :param group: Group id or ids
+        :param duration: timedelta or seconds
+        """
+        _black_list_group.add_many([group] if isinstance(group, int) else group, duration)
+
+    @staticmethod
+    def set_block_user(qq: Union[int, Iterable[int]], duration: Union[timedelta, float]):
+        """Block users for a duration
+
+        :param qq: qq or qqs
+        :param duration: timedelta or seconds
+        """
+        _black_list_user.add_many([qq] if isinstance(qq, int) else qq, duration)
+
+    @staticmethod
+    def remove_block_group(group: Union[int, Iterable[int]]):
+        _black_list_group.remove_many([group] if isinstance(group, int) else group)
+
+    @staticmethod
+    def remove_block_user(qq: Union[int, Iterable[int]]):
+        _black_list_user.remove_many([qq] if isinstance(qq, int) else qq)
+
+    @staticmethod
+    def get_blocked_groups() -> Dict[int, datetime]:
+        return _black_list_group.items()
+
+    @staticmethod
+    def get_blocked_users() -> Dict[int, datetime]:
+        return _black_list_user.items()
 
     @staticmethod
     def get_priv_from_event(event: Event):
@@ -337,19 +671,20 @@ class Service:
             else:
                 return self.user_privs.get(qq_or_event, Privilege.DEFAULT)
         elif isinstance(qq_or_event, MessageEvent):
-            qq = qq_or_event.sender.qq
-            ev_priv = self.get_priv_from_event(qq_or_event)
-            sv_priv = self.user_privs.get(qq, Privilege.DEFAULT)
-            if qq in ajenga.config.SUPERUSERS:
-                return Privilege.SUPERUSER
-            elif ev_priv == Privilege.BLACK or sv_priv == Privilege.BLACK:
-                return Privilege.BLACK
-            else:
-                return max(ev_priv, sv_priv)
+            return self._merge_user_priv(qq_or_event.sender.qq, self.get_priv_from_event(qq_or_event))
         else:
             self.logger.error(f'Unknown qq_or_event {qq_or_event}')
             return Privilege.DEFAULT
 
+    def _merge_user_priv(self, qq: ContactIdType, ev_priv: int) -> int:
+        sv_priv = self.user_privs.get(qq, Privilege.DEFAULT)
+        if qq in ajenga.config.SUPERUSERS:
+            return Privilege.SUPERUSER
+        elif ev_priv == Privilege.BLACK or sv_priv == Privilege.BLACK:
+            return Privilege.BLACK
+        else:
+            return max(ev_priv, sv_priv)
+
     def set_user_priv(self, qq_or_event: Union[ContactIdType, MessageEvent],
                       priv: int):
         # print(self.user_privs)
@@ -361,28 +696,57 @@ class Service:
             self.logger.error(f'Unknown qq_or_event {qq_or_event}')
         _save_service_config(self)
 
+    @property
+    def enable_on_default(self) -> bool:
+        return self._enable_on_default
+
+    @enable_on_default.setter
+    def enable_on_default(self, value: bool):
+        self._enable_on_default = value
+        _enable_index.update(self)
+
+    @property
+    def enable_group(self) -> FrozenSet[ContactIdType]:
+        """Groups enabling the service, assign to replace or use `set_enable`"""
+        return frozenset(self._enable_group)
+
+    @enable_group.setter
+    def enable_group(self, groups: Iterable[ContactIdType]):
+        self._enable_group = set(groups)
+        _enable_index.update(self)
+
+    @property
+    def disable_group(self) -> FrozenSet[ContactIdType]:
+        """Groups disabling the service, assign to replace or use `set_disable`"""
+        return frozenset(self._disable_group)
+
+    @disable_group.setter
+    def disable_group(self, groups: Iterable[ContactIdType]):
+        self._disable_group = set(groups)
+        _enable_index.update(self)
+
     def set_enable(self, group: ContactIdType):
-        self.enable_group.add(group)
-        self.disable_group.discard(group)
+        self._enable_group.add(group)
+        self._disable_group.discard(group)
+        _enable_index.set(self, group, True)
         _save_service_config(self)
         self.logger.info(f'Service {self.name} is enabled at group {group}')
 
     def set_disable(self, group: ContactIdType):
-        self.enable_group.discard(group)
-        self.disable_group.add(group)
+        self._enable_group.discard(group)
+        self._disable_group.add(group)
+        _enable_index.set(self, group, False)
         _save_service_config(self)
         self.logger.info(f'Service {self.name} is disabled at group {group}')
 
     def check_enabled(self, group: ContactIdType):
-        return bool(
-            (group in self.enable_group)
-            or (self.enable_on_default and group not in self.disable_group))
+        bit = _enable_index.bit(self)
+        return bit is not None and bool(_enable_index.mask(group) >> bit & 1)
 
     async def get_enabled_groups(self) -> dict:
         ret = {}
-        for qq, ses in app.get_sessions().items():
-            group_list = await ses.api.get_group_list()
-            for group in group_list.data:
+        for qq, group_list in (await group_roster.get_all()).items():
+            for group in group_list:
                 if self.check_enabled(group.id):
                     ret[group.id] = qq
         return ret
@@ -418,23 +782,48 @@ class Service:
 
             self.scheduler.scheduled_job(*args, **kwargs)(_sched)
 
-            return self.on(
-                router.event_type_is(EventType.Scheduler)
-                & router.std.if_(lambda ev: ev.id == uid))(func)
+            # Without `Service.on` predicates, so scheduler id nodes of all services
+            # merge and a tick is routed by one lookup
+            return (ServiceGraphImpl(self) & router.event_type_is(EventType.Scheduler)
+                    & router.scheduler_id_is(uid))(func)
 
         return deco
 
-    async def broadcast(self, *messages: Message_T, interval=0.2):
-        groups = await self.get_enabled_groups()
-        for group, qq in groups.items():
-            try:
-                for message in messages:
-                    await app.get_session(qq).api.send_group_message(
-                        group=group, message=message)
-                    await asyncio.sleep(interval)
-            except Exception as e:
-                self.logger.exception(e)
-                self.logger.error(f"Failed to broadcast to group {group}")
+    async def create_broadcast(self,
+                               *messages: Message_T,
+                               interval: float = None,
+                               on_progress: Callable[[BroadcastTask], Any] = None) -> BroadcastTask:
+        """Create a broadcast of messages to all enabled groups without sending
+
+        Keep the task to resume it with `BroadcastTask.run` if it is
+        interrupted or some groups failed.
+
+        :param messages: Messages sent to every group in order
+        :param interval: Seconds between sends of a bot, BROADCAST_RATE if None
+        :param on_progress: Called after each group finished
+        :return: BroadcastTask not started
+        """
+        return BroadcastTask(messages,
+                             await self.get_enabled_groups(),
+                             interval=interval,
+                             on_progress=on_progress,
+                             logger=self.logger)
+
+    async def broadcast(self,
+                        *messages: Message_T,
+                        interval: float = None,
+                        on_progress: Callable[[BroadcastTask], Any] = None) -> BroadcastTask:
+        """Send messages to all enabled groups
+
+        See `create_broadcast` to keep a broadcast which may be interrupted.
+
+        :param messages: Messages sent to every group in order
+        :param interval: Seconds between sends of a bot, BROADCAST_RATE if None
+        :param on_progress: Called after each group finished
+        :return: Finished BroadcastTask, run it again to retry failed groups
+        """
+        task = await self.create_broadcast(*messages, interval=interval, on_progress=on_progress)
+        return await task.run()
 
 
 def set_current_plugin(plugin: "Plugin") -> None:
@@ -468,9 +857,29 @@ def remove_service(key: Union[str, Service]) -> bool:
         logger.warning(f"Service {key} not exists")
         return False
 
-    del _loaded_services[service.key]
+    # A reloaded service of the same key may have replaced it
+    if _loaded_services.get(service.key) is service:
+        del _loaded_services[service.key]
     return True
 
 
 def get_loaded_services() -> Set[Service]:
     return set(_loaded_services.values())
+
+
+def get_enabled_services(group: ContactIdType) -> Set[Service]:
+    """Get all loaded services enabled in a group
+
+    :param group: Group id
+    :return: Set of Service objects
+    """
+    return _enable_index.services(group)
+
+
+def get_saved_enabled_services(group: ContactIdType) -> Set[str]:
+    """Get keys of all saved services enabled in a group, loaded or not
+
+    :param group: Group id
+    :return: Set of service keys
+    """
+    return _get_config_store().enabled_services(group)
@@ -0,0 +1,144 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ajenga.log import logger
+from ajenga.typing import Dict, Iterable, Set
+
+
+class ServiceConfigStore:
+    """SQLite store of all service configs
+
+    Configs are bulk loaded once, enable and disable groups are kept in an
+    indexed table so services enabled in a group can be queried together.
+    The connection may be used from the config writer thread.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS services ('
+                               'key TEXT PRIMARY KEY, name TEXT, use_priv INTEGER, manage_priv INTEGER, '
+                               'enable_on_default INTEGER, visible INTEGER, user_privs TEXT)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS service_groups ('
+                               'key TEXT NOT NULL, group_id INTEGER NOT NULL, enabled INTEGER NOT NULL, '
+                               'PRIMARY KEY (key, group_id))')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS service_groups_group ON service_groups (group_id)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS blacklist ('
+                               'kind TEXT NOT NULL, id INTEGER NOT NULL, expires REAL NOT NULL, '
+                               'PRIMARY KEY (kind, id))')
+        self._configs: Dict[str, dict] = None
+
+    def migrate_json(self, config_dir: str) -> int:
+        """Import per service JSON config files once
+
+        :param config_dir: Directory of `<service key>.json` files
+        :return: Number of configs imported
+        """
+        if self._conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return 0
+        configs = {}
+        for config_file in glob.glob(os.path.join(config_dir, '*.json')):
+            service_key = os.path.basename(config_file)[:-len('.json')]
+            try:
+                with open(config_file, encoding='utf8') as f:
+                    configs[service_key] = json.load(f)
+            except Exception as e:
+                logger.exception(e)
+                logger.error(f'Failed to migrate config file {config_file}')
+        self.save(configs)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', '1')")
+        if configs:
+            logger.info(f'Migrated {len(configs)} service configs from {config_dir}')
+        return len(configs)
+
+    def load_all(self) -> Dict[str, dict]:
+        """Load configs of all services, only read from database once"""
+        if self._configs is not None:
+            return self._configs
+        configs = {}
+        with self._lock:
+            for key, name, use_priv, manage_priv, enable_on_default, visible, user_privs in self._conn.execute(
+                    'SELECT key, name, use_priv, manage_priv, enable_on_default, visible, user_privs FROM services'):
+                configs[key] = {
+                    'name': name,
+                    'use_priv': use_priv,
+                    'manage_priv': manage_priv,
+                    'enable_on_default': None if enable_on_default is None else bool(enable_on_default),
+                    'visible': None if visible is None else bool(visible),
+                    'enable_group': [],
+                    'disable_group': [],
+                    'user_privs': json.loads(user_privs) if user_privs else [],
+                }
+            for key, group, enabled in self._conn.execute('SELECT key, group_id, enabled FROM service_groups'):
+                if key in configs:
+                    configs[key]['enable_group' if enabled else 'disable_group'].append(group)
+        self._configs = configs
+        return configs
+
+    def load(self, key: str) -> dict:
+        return self.load_all().get(key, {})
+
+    def save(self, configs: Dict[str, dict]) -> None:
+        if not configs:
+            return
+        with self._lock, self._conn:
+            for key, config in configs.items():
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO services '
+                    '(key, name, use_priv, manage_priv, enable_on_default, visible, user_privs) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, config.get('name'), config.get('use_priv'), config.get('manage_priv'),
+                     config.get('enable_on_default'), config.get('visible'),
+                     json.dumps(config.get('user_privs', []))))
+                self._conn.execute('DELETE FROM service_groups WHERE key = ?', (key, ))
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO service_groups (key, group_id, enabled) VALUES (?, ?, ?)',
+                    [(key, group, 1) for group in config.get('enable_group', [])]
+                    + [(key, group, 0) for group in config.get('disable_group', [])])
+                if self._configs is not None:
+                    self._configs[key] = config
+
+    def enabled_services(self, group: int) -> Set[str]:
+        """Keys of saved services enabled in a group
+
+        :param group: Group id
+        :return: Set of service keys
+        """
+        with self._lock:
+            return set(key for key, in self._conn.execute(
+                'SELECT s.key FROM services s '
+                'LEFT JOIN service_groups g ON g.key = s.key AND g.group_id = ? '
+                'WHERE COALESCE(g.enabled, s.enable_on_default) = 1', (group, )))
+
+    def load_blacklist(self, kind: str) -> Dict[int, float]:
+        """Load unexpired entries of a blacklist, purging expired ones
+
+        :param kind: Name of the blacklist
+        :return: Dict of id to expire timestamp
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM blacklist WHERE kind = ? AND expires < ?', (kind, time.time()))
+            return dict(self._conn.execute('SELECT id, expires FROM blacklist WHERE kind = ?', (kind, )))
+
+    def save_blacklist(self, kind: str, entries: Dict[int, float]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO blacklist (kind, id, expires) VALUES (?, ?, ?)',
+                                   [(kind, contact, expires) for contact, expires in entries.items()])
+
+    def remove_blacklist(self, kind: str, ids: Iterable[int]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM blacklist WHERE kind = ? AND id = ?',
+                                   [(kind, contact) for contact in ids])
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,6 +1,6 @@
 import asyncio
 
-from ajenga.app import handle_event
+from ajenga.app import handle_event, handle_event_nowait
 from ajenga.event import (CustomEvent, Event, EventProvider,
                           FriendMessageEvent, GroupMessageEvent, MessageEvent,
                           MetaEvent, TempMessageEvent)
@@ -13,8 +13,8 @@ class MetaProvider(EventProvider):
     async def send(self, event: MetaEvent):
         return await handle_event(self, event)
 
-    def send_nowait(self, event: MetaEvent):
-        return asyncio.create_task(handle_event(self, event))
+    def send_nowait(self, event: MetaEvent) -> asyncio.Future:
+        return handle_event_nowait(self, event)
 
     @property
     def type(self) -> str:
@@ -32,8 +32,8 @@ class BotSession(EventProvider):
     async def handle_event(self, event: Event):
         return await handle_event(self, event, bot=self)
 
-    def handle_event_nowait(self, event: Event) -> asyncio.Task:
-        return asyncio.create_task(handle_event(self, event, bot=self))
+    def handle_event_nowait(self, event: Event) -> asyncio.Future:
+        return handle_event_nowait(self, event, bot=self)
 
     def __str__(self):
         return f'<{type(self).__name__}: {id(self)}>'
@@ -85,9 +85,9 @@ class ChannelProvider(EventProvider):
         event = CustomEvent(self.channel, **kwargs)
         return await handle_event(self, event)
 
-    def send_nowait(self, **kwargs):
+    def send_nowait(self, **kwargs) -> asyncio.Future:
         event = CustomEvent(self.channel, **kwargs)
-        return asyncio.create_task(handle_event(self, event))
+        return handle_event_nowait(self, event)
 
     @property
     def type(self) -> str:
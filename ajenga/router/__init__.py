@@ -10,6 +10,7 @@ key_meta_type = KeyFunctionImpl(lambda event: event.meta_type)
 key_meta_plugin = KeyFunctionImpl(lambda event: event.plugin)
 key_channel = KeyFunctionImpl(lambda event: event.channel)
 key_protocol = KeyFunctionImpl(lambda event: event.protocol)
+key_scheduler_id = KeyFunctionImpl(lambda event: event.id)
 
 
 def key_(__key):
@@ -21,6 +22,7 @@ meta_type_is = partial(make_graph_deco(EqualNode), key=key_meta_type)
 meta_plugin_is = partial(make_graph_deco(EqualNode), key=key_meta_plugin)
 channel_is = partial(make_graph_deco(EqualNode), key=key_channel)
 protocol_is = partial(make_graph_deco(EqualNode), key=key_protocol)
+scheduler_id_is = partial(make_graph_deco(EqualNode), key=key_scheduler_id)
 
 
 def channel(channel: str):
@@ -0,0 +1,132 @@
+from collections import deque
+
+from ajenga.typing import Dict, FrozenSet, Iterable, List, Optional
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over a reference counted keyword set
+
+    Keywords may be added and removed at any time, failure links are rebuilt
+    lazily on the next scan after a change.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Optional[str]] = [None]
+        # Nearest state along the failure chain which outputs a keyword
+        self._report: List[int] = [0]
+        self._refs: Dict[str, int] = {}
+        self._garbage = 0
+        self._dirty = False
+        self.version = 0
+
+    def __contains__(self, keyword: str) -> bool:
+        return keyword in self._refs
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    def add(self, keyword: str) -> None:
+        """Add a reference to keyword, inserting it if not exists
+
+        :param keyword: Non-empty keyword
+        """
+        if not keyword:
+            raise ValueError('Cannot add an empty keyword')
+        if keyword in self._refs:
+            self._refs[keyword] += 1
+            return
+        self._refs[keyword] = 1
+        self._insert(keyword)
+        self._changed()
+
+    def discard(self, keyword: str) -> None:
+        """Release a reference to keyword, removing it when not referenced
+
+        :param keyword: Keyword
+        """
+        if keyword not in self._refs:
+            return
+        self._refs[keyword] -= 1
+        if self._refs[keyword] > 0:
+            return
+        del self._refs[keyword]
+        self._output[self._walk(keyword)] = None
+        self._garbage += len(keyword)
+        self._changed()
+
+    def update(self, keywords: Iterable[str]) -> None:
+        for keyword in keywords:
+            self.add(keyword)
+
+    def find(self, text: str) -> FrozenSet[str]:
+        """Find every keyword occurring in text in a single scan
+
+        :param text: Text to scan
+        :return: Set of keywords found
+        """
+        if self._dirty:
+            self._build()
+        goto, fail, output, report = self._goto, self._fail, self._output, self._report
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            hit = state if output[state] is not None else report[state]
+            while hit:
+                found.add(output[hit])
+                hit = report[hit]
+        return frozenset(found)
+
+    def _changed(self):
+        self._dirty = True
+        self.version += 1
+
+    def _walk(self, keyword: str) -> int:
+        state = 0
+        for char in keyword:
+            state = self._goto[state][char]
+        return state
+
+    def _insert(self, keyword: str) -> None:
+        state = 0
+        for char in keyword:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._report.append(0)
+                self._goto[state][char] = nxt
+            state = nxt
+        self._output[state] = keyword
+
+    def _build(self) -> None:
+        if self._garbage > sum(map(len, self._refs)):
+            # Too many dead states, compact the trie
+            self._goto, self._fail, self._output, self._report = [{}], [0], [None], [0]
+            self._garbage = 0
+            for keyword in self._refs:
+                self._insert(keyword)
+
+        goto, fail, output, report = self._goto, self._fail, self._output, self._report
+        queue = deque()
+        for nxt in goto[0].values():
+            fail[nxt] = 0
+            report[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for char, nxt in goto[state].items():
+                link = fail[state]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                link = goto[link].get(char, 0)
+                fail[nxt] = link
+                report[nxt] = link if output[link] is not None else report[link]
+                queue.append(nxt)
+        self._dirty = False
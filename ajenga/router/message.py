@@ -1,19 +1,22 @@
 import re
+import weakref
 import pregex
 from functools import partial
 from ajenga.typing import AsyncIterable
 from ajenga.typing import Pattern
 from ajenga.typing import Type
 from ajenga.typing import TypeVar
-from ajenga.typing import Union, Set
+from ajenga.typing import Dict, FrozenSet, Hashable, Optional, Tuple, Union, Set
 from ajenga.typing import final
 
+from ajenga.event import Event
 from ajenga.event import EventType
 from ajenga.event import FriendMessageEvent
 from ajenga.event import GroupMessageEvent
 from ajenga.event import MessageEvent
 from ajenga.event import MessageEventTypes
 from ajenga.event import TempMessageEvent
+from ajenga.message import MessageChain
 from ajenga.message import MessageElement
 from ajenga.message import MessageType
 from ajenga.router import std
@@ -22,6 +25,7 @@ from ajenga.router.models import TerminalNode
 from ajenga.router.state import RouteState
 from ajenga.router.keyfunc import KeyFunctionImpl
 from ajenga.router.keystore import KeyStore
+from ajenga.router.automaton import KeywordAutomaton
 from ajenga.router.std import AbsNonterminalNode
 from ajenga.router.std import EqualNode
 from ajenga.router.std import make_graph_deco
@@ -29,16 +33,78 @@ from ajenga.router.trie import PrefixNode
 from . import event_type_is
 
 
-key_message_content_string = KeyFunctionImpl(lambda event: event.message.as_plain())
-key_message_content_string_stripped = KeyFunctionImpl(lambda event: event.message.as_plain().strip())
-key_message_content_string_lstripped = KeyFunctionImpl(lambda event: event.message.as_plain().lstrip())
+class _lazy:
+    """Non-data descriptor caching the computed value in the instance"""
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.func(instance)
+        return value
+
+
+class MessageView:
+    """Derived views of a message chain shared by all key functions
+
+    Every view is computed lazily at most once, use `message_view` to get
+    the view memoized on a chain so it is dropped when the chain is mutated.
+    """
+    message: MessageChain
+
+    def __init__(self, message: MessageChain):
+        self.message = message
+
+    @_lazy
+    def plain(self) -> str:
+        return self.message.as_plain()
+
+    @_lazy
+    def stripped(self) -> str:
+        return self.plain.strip()
+
+    @_lazy
+    def lstripped(self) -> str:
+        return self.plain.lstrip()
+
+    @_lazy
+    def reversed(self) -> str:
+        return self.plain[::-1]
+
+    @_lazy
+    def reversed_stripped(self) -> str:
+        return self.stripped[::-1]
+
+    @_lazy
+    def reversed_lstripped(self) -> str:
+        return self.plain.rstrip()[::-1]
+
+    @_lazy
+    def encoded(self) -> str:
+        return self.message.encode()
+
+    @property
+    def types(self) -> FrozenSet[MessageType]:
+        return self.message.types
+
+
+def message_view(message: MessageChain) -> MessageView:
+    return message.memoize(MessageView, MessageView)
+
+
+key_message_content_string = KeyFunctionImpl(lambda event: message_view(event.message).plain)
+key_message_content_string_stripped = KeyFunctionImpl(lambda event: message_view(event.message).stripped)
+key_message_content_string_lstripped = KeyFunctionImpl(lambda event: message_view(event.message).lstripped)
 
 key_message_content_string_reversed = KeyFunctionImpl(
-    lambda event: event.message.as_plain()[::-1])
+    lambda event: message_view(event.message).reversed)
 key_message_content_string_reversed_stripped = KeyFunctionImpl(
-    lambda event: event.message.as_plain()[::-1].strip())
+    lambda event: message_view(event.message).reversed_stripped)
 key_message_content_string_reversed_lstripped = KeyFunctionImpl(
-    lambda event: event.message.as_plain()[::-1].lstrip())
+    lambda event: message_view(event.message).reversed_lstripped)
 
 key_message_qq = KeyFunctionImpl(lambda event: event.sender.qq)
 key_message_group = KeyFunctionImpl(lambda event: event.group)
@@ -71,42 +137,61 @@ def startswith(text: str, *texts: str, strip: bool = True):
 
 
 def endswith(text: str, *texts: str, strip: bool = True):
-    if strip:
-        return make_graph_deco(PrefixNode)(
-            text[::-1],
-            *map(lambda x: x[::-1], texts),
-            key=key_message_content_string_reversed_lstripped)
-    else:
-        return make_graph_deco(PrefixNode)(
-            text[::-1],
-            *map(lambda x: x[::-1], texts),
-            key=key_message_content_string_reversed)
+    return make_graph_deco(SuffixNode)(*((suffix, strip) for suffix in (text, *texts)))
+
+
+_REGEX_META_CHARS = frozenset('.^$*+?{}[]|()\\')
+_REGEX_QUANTIFIERS = frozenset('*+?{')
+
+
+def _literal_prefix(pattern: Pattern) -> str:
+    """Get the literal text every match of the pattern must start with
+
+    Conservative: gives up on alternations, case-insensitive or verbose patterns.
+    """
+    source = pattern.pattern
+    if not isinstance(source, str) or pattern.flags & (re.IGNORECASE | re.VERBOSE) or '|' in source:
+        return ''
+    begin = 1 if source.startswith('^') else 0
+    end = begin
+    while end < len(source) and source[end] not in _REGEX_META_CHARS:
+        end += 1
+    if end < len(source) and source[end] in _REGEX_QUANTIFIERS:
+        end -= 1
+    return source[begin:end] if end > begin else ''
+
+
+def _regex_graph(pattern: Pattern, predicate, key):
+    graph = std.if_(KeyFunctionImpl(predicate, key=key))
+    prefix = _literal_prefix(pattern)
+    if prefix:
+        # Share the prefix trie so only patterns able to match are evaluated
+        graph = make_graph_deco(PrefixNode)(prefix, key=key_message_content_string) & graph
+    return graph
 
 
 def match(pattern: Pattern, flags=0, key='match'):
-    return std.if_(KeyFunctionImpl(
-        lambda event: re.match(pattern, event.message.as_plain(), flags),
-        key=key,
-    ))
+    pattern = re.compile(pattern, flags)
+    return _regex_graph(pattern, lambda event: pattern.match(message_view(event.message).plain), key)
 
 
 def fullmatch(pattern: Pattern, flags=0, key='match'):
-    return std.if_(KeyFunctionImpl(
-        lambda event: re.fullmatch(pattern, event.message.as_plain(), flags),
-        key=key,
-    ))
+    pattern = re.compile(pattern, flags)
+    return _regex_graph(pattern, lambda event: pattern.fullmatch(message_view(event.message).plain), key)
 
 
 def pmatch(pattern, flags: pregex.RegexFlag = 0, key='match'):
+    pattern = pregex.compile(pattern, flags=flags, default_require_post=(MessageElement.decode, None))
     return std.if_(KeyFunctionImpl(
-        lambda event: pregex.match(pattern, event.message.encode(), flags=flags, default_require_post=(MessageElement.decode, None)),
+        lambda event: pattern.match(message_view(event.message).encoded),
         key=key,
     ))
 
 
 def pfullmatch(pattern, flags: pregex.RegexFlag = 0, key='match'):
+    pattern = pregex.compile(pattern, flags=flags, default_require_post=(MessageElement.decode, None))
     return std.if_(KeyFunctionImpl(
-        lambda event: pregex.fullmatch(pattern, event.message.encode(), flags=flags, default_require_post=(MessageElement.decode, None)),
+        lambda event: pattern.fullmatch(message_view(event.message).encoded),
         key=key,
     ))
 
@@ -130,10 +215,8 @@ class MessageTypeNode(AbsNonterminalNode):
     async def _route(self, state: RouteState) -> Set[RouteResult_T]:
         res = set()
         nodes = set()
-        message = state.store['event'].message
-        for msg in message:
-            if msg.type in self._successors:
-                nodes.update(self._successors[msg.type])
+        for msg_type in self._successors.keys() & state.store['event'].message.types:
+            nodes.update(self._successors[msg_type])
 
         for node in nodes:
             if isinstance(node, TerminalNode):
@@ -147,6 +230,174 @@ def has(msg_type: Type[MessageElement], *or_more: Type[MessageElement]):
     return make_graph_deco(MessageTypeNode)(msg_type, *or_more)
 
 
+_SUFFIX_END = object()
+
+
+@final
+class SuffixNode(AbsNonterminalNode):
+    """Route by suffix of the plain message
+
+    Keys are (suffix, strip) pairs. Suffixes are matched by walking a trie of
+    reversed suffixes backwards from the end of the shared plain view, so no
+    reversed copy of the message is made.
+    """
+
+    def __init__(self, suffix: Tuple[str, bool] = ..., *or_more: Tuple[str, bool]):
+        super().__init__()
+        self._tries: Dict[bool, dict] = {}
+        self._indexed = 0
+        if suffix is not ...:
+            self.add_key(suffix)
+        for more in or_more:
+            self.add_key(more)
+
+    def add_key(self, key):
+        super().add_key(key)
+        self._indexed = -1
+
+    def _build(self):
+        self._tries = {}
+        for suffix, strip in self._successors:
+            node = self._tries.setdefault(strip, {})
+            for char in reversed(suffix):
+                node = node.setdefault(char, {})
+            node[_SUFFIX_END] = suffix
+        self._indexed = len(self._successors)
+
+    def _match(self, text: str, strip: bool):
+        node = self._tries[strip]
+        end = len(text)
+        if strip:
+            while end and text[end - 1].isspace():
+                end -= 1
+        if _SUFFIX_END in node:
+            yield node[_SUFFIX_END]
+        for i in range(end - 1, -1, -1):
+            node = node.get(text[i])
+            if node is None:
+                return
+            if _SUFFIX_END in node:
+                yield node[_SUFFIX_END]
+
+    async def _route(self, state: RouteState) -> Set[RouteResult_T]:
+        if self._indexed != len(self._successors):
+            self._build()
+        res = set()
+        nodes = set()
+        text = message_view(state.store['event'].message).plain
+        for strip in self._tries:
+            for suffix in self._match(text, strip):
+                nodes.update(self._successors.get((suffix, strip), ()))
+
+        for node in nodes:
+            if isinstance(node, TerminalNode):
+                res.add(state.wrap(node))
+            elif isinstance(node, NonterminalNode):
+                res |= await node.route(state)
+        return res
+
+
+_keyword_automaton = KeywordAutomaton()
+
+
+def _find_keywords(message: MessageChain) -> FrozenSet[str]:
+    return message.memoize(
+        (_keyword_automaton, _keyword_automaton.version),
+        lambda m: _keyword_automaton.find(message_view(m).plain))
+
+
+@final
+class ContainsNode(AbsNonterminalNode):
+    """Route by keywords contained in the message
+
+    Keywords of all nodes are registered to one shared automaton, so the
+    message is scanned only once no matter how many keywords are routed.
+    """
+
+    def __init__(self, keyword: str = ..., *or_more: str):
+        super().__init__()
+        self._registered: Set[str] = set()
+        weakref.finalize(self, _release_keywords, self._registered)
+        if keyword is not ...:
+            self.add_key(keyword)
+        for more in or_more:
+            self.add_key(more)
+
+    def add_key(self, key):
+        super().add_key(key)
+        if key not in self._registered:
+            _keyword_automaton.add(key)
+            self._registered.add(key)
+
+    def _sync(self):
+        # Keys left without successors by unsubscribing are dropped, so the
+        # key count matches the registered keywords again
+        for key in [key for key, nodes in self._successors.items() if not nodes]:
+            del self._successors[key]
+        live = set(self._successors)
+        for key in live - self._registered:
+            _keyword_automaton.add(key)
+        for key in self._registered - live:
+            _keyword_automaton.discard(key)
+        self._registered.clear()
+        self._registered.update(live)
+
+    async def _route(self, state: RouteState) -> Set[RouteResult_T]:
+        if len(self._successors) != len(self._registered):
+            self._sync()
+        res = set()
+        nodes = set()
+        for keyword in _find_keywords(state.store['event'].message):
+            if keyword not in self._registered:
+                continue
+            successors = self._successors.get(keyword)
+            if successors:
+                nodes.update(successors)
+            else:
+                # Handlers were unsubscribed, release the keyword
+                _keyword_automaton.discard(keyword)
+                self._registered.discard(keyword)
+                self._successors.pop(keyword, None)
+
+        for node in nodes:
+            if isinstance(node, TerminalNode):
+                res.add(state.wrap(node))
+            elif isinstance(node, NonterminalNode):
+                res |= await node.route(state)
+        return res
+
+
+def _release_keywords(keywords: Set[str]):
+    for keyword in keywords:
+        _keyword_automaton.discard(keyword)
+
+
+def contains(keyword: str, *keywords: str, key='keywords'):
+    """Match messages containing any of the keywords
+
+    The handler receives every matched keyword as a frozenset named by `key`.
+    """
+    wanted = frozenset((keyword, *keywords))
+    return make_graph_deco(ContainsNode)(keyword, *keywords) & std.if_(KeyFunctionImpl(
+        lambda event: _find_keywords(event.message) & wanted,
+        key=key,
+    ))
+
+
+def same_event_key(ev: Event) -> Optional[Hashable]:
+    """Get a key equal for all events matched by `same_event_as`
+
+    :param ev: Event
+    :return: Key, or None if the event is not a message event
+    """
+    if isinstance(ev, GroupMessageEvent):
+        return ev.type, ev.group, ev.sender.qq
+    elif isinstance(ev, (FriendMessageEvent, TempMessageEvent)):
+        return ev.type, ev.sender.qq
+    else:
+        return None
+
+
 def same_event_as(ev: MessageEvent):
     if isinstance(ev, GroupMessageEvent):
         return is_group & group_from(ev.group) & qq_from(ev.sender.qq)
@@ -1,5 +1,5 @@
-from typing import (Any, AnyStr, AsyncIterable, Awaitable, ClassVar, Callable, Collection, Container, Coroutine,
-                    Dict, Generic, Hashable, Iterable, List, Mapping, OrderedDict, Pattern, Optional,
+from typing import (Any, AnyStr, AsyncIterable, Awaitable, ClassVar, Callable, Collection, Container, Coroutine, Deque,
+                    Dict, FrozenSet, Generic, Hashable, Iterable, List, Mapping, OrderedDict, Pattern, Optional,
                     Set, Tuple, Type, TypeVar, TYPE_CHECKING, Union)
 
 try:
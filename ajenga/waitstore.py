@@ -0,0 +1,175 @@
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+
+import ajenga
+from ajenga.log import logger
+from ajenga.typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+
+@dataclass
+class StoredWaiter:
+    id: int
+    key: str
+    deadline: float
+    handler: str
+    suspend_other: bool
+    suspend_next_priority: bool
+
+    def resolve(self) -> Optional[Callable]:
+        return resolve_handler(self.handler)
+
+
+def _encode_default(obj: Any):
+    if isinstance(obj, Enum):
+        return obj.value
+    # Bot sessions are restored as new objects, identify them by account
+    qq = getattr(obj, 'qq', None)
+    if qq is not None:
+        return qq
+    raise TypeError(f'Cannot persist wait key containing {obj!r}')
+
+
+def encode_key(key: Hashable) -> str:
+    return json.dumps(key, default=_encode_default, ensure_ascii=False)
+
+
+def handler_ref(func: Callable) -> str:
+    """Get the importable reference of a module level function
+
+    :param func: Function
+    :return: Reference like "module:qualname"
+    """
+    ref = f'{func.__module__}:{func.__qualname__}'
+    if '<locals>' in ref or resolve_handler(ref) is not func:
+        raise ValueError(f'Resume handler {func} is not a module level function')
+    return ref
+
+
+def resolve_handler(ref: str) -> Optional[Callable]:
+    """Resolve a reference got by `handler_ref` among modules loaded
+
+    Modules are never imported here, so plugin modules are only imported by
+    the plugin loader and their services belong to the right plugin.
+
+    :param ref: Reference like "module:qualname"
+    :return: Function, None if its module is not loaded
+    """
+    module_name, qualname = ref.split(':', maxsplit=1)
+    obj = sys.modules.get(module_name)
+    if obj is None:
+        return None
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class WaiterStore:
+    """SQLite store of waits surviving restarts
+
+    Only routing key, deadline and a resume handler reference are stored,
+    the waiting coroutine itself cannot be. Expired waits are purged in bulk
+    when the store is opened. Waits are kept in memory and written behind by
+    a single background thread, so events never wait for the database.
+    """
+
+    def __init__(self, path: str):
+        path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS waiters ('
+                           'id INTEGER PRIMARY KEY, key TEXT NOT NULL, deadline REAL NOT NULL, '
+                           'handler TEXT NOT NULL, suspend_other INTEGER, suspend_next_priority INTEGER)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS waiters_key ON waiters (key)')
+        purged = self.purge()
+        if purged:
+            logger.info(f'Purged {purged} expired waiters')
+        self._waiters: Dict[str, Dict[int, StoredWaiter]] = {}
+        for row in self._conn.execute(
+                'SELECT id, key, deadline, handler, suspend_other, suspend_next_priority FROM waiters'):
+            waiter = StoredWaiter(*row)
+            self._waiters.setdefault(waiter.key, {})[waiter.id] = waiter
+        # Ids are allocated here since rows are inserted in background
+        self._next_id = (self._conn.execute('SELECT MAX(id) FROM waiters').fetchone()[0] or 0) + 1
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='waiter_store')
+
+    def purge(self) -> int:
+        return self._conn.execute('DELETE FROM waiters WHERE deadline < ?', (time.time(), )).rowcount
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._waiters
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    def _submit(self, sql: str, params: Iterable) -> None:
+        self._executor.submit(self._write, sql, params)
+
+    def _write(self, sql: str, params: Iterable) -> None:
+        try:
+            self._conn.execute(sql, params)
+        except Exception as e:
+            logger.exception(e)
+            logger.error('Failed to write waiter store')
+
+    def add(self, key: str, timeout: float, handler: str, suspend_other: bool, suspend_next_priority: bool) -> int:
+        waiter = StoredWaiter(self._next_id, key, time.time() + timeout, handler,
+                              suspend_other, suspend_next_priority)
+        self._next_id += 1
+        self.restore(waiter)
+        return waiter.id
+
+    def remove(self, key: str, waiter_id: int) -> None:
+        waiters = self._waiters.get(key)
+        if waiters is None or waiters.pop(waiter_id, None) is None:
+            return
+        if not waiters:
+            del self._waiters[key]
+        self._submit('DELETE FROM waiters WHERE id = ?', (waiter_id, ))
+
+    def restore(self, waiter: StoredWaiter) -> None:
+        self._waiters.setdefault(waiter.key, {})[waiter.id] = waiter
+        self._submit(
+            'INSERT OR REPLACE INTO waiters (id, key, deadline, handler, suspend_other, suspend_next_priority) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (waiter.id, waiter.key, waiter.deadline, waiter.handler, waiter.suspend_other,
+             waiter.suspend_next_priority))
+
+    def pop(self, key: str) -> List[StoredWaiter]:
+        """Remove and get all unexpired waits of a key
+
+        :param key: Encoded wait key
+        :return: Stored waits ordered by creation
+        """
+        waiters = self._waiters.pop(key, None)
+        if not waiters:
+            return []
+        self._submit('DELETE FROM waiters WHERE key = ?', (key, ))
+        now = time.time()
+        return [waiter for _, waiter in sorted(waiters.items()) if waiter.deadline >= now]
+
+    def close(self) -> None:
+        """Finish writes queued and close the database"""
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+
+_store: Optional[WaiterStore] = None
+
+
+def get_waiter_store() -> Optional[WaiterStore]:
+    """Get the waiter store configured by WAITER_STORE, None if not enabled"""
+    global _store
+    if _store is None:
+        path = getattr(ajenga.config, 'WAITER_STORE', None)
+        if path:
+            _store = WaiterStore(path)
+            atexit.register(_store.close)
+    return _store
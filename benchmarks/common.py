@@ -0,0 +1,72 @@
+"""Helpers shared by benchmarks
+
+Benchmarks are plain scripts run from the repository root, e.g.
+
+    python -m benchmarks.routing
+"""
+import asyncio
+import time
+
+from ajenga.event import EventProvider, GroupMessageEvent, Sender
+from ajenga.message import MessageChain, Plain
+from ajenga.models import ContactIdType, GroupPermission
+from ajenga.router.engine import Engine
+from ajenga.typing import Callable, Collection, Iterable, List
+
+
+class BenchSource(EventProvider):
+    pass
+
+
+source = BenchSource()
+
+
+def group_message(text: str, group: ContactIdType = 1, qq: ContactIdType = 10000) -> GroupMessageEvent:
+    return GroupMessageEvent(message=MessageChain([Plain(text)]),
+                             message_id=0,
+                             sender=Sender(qq=qq, name='bench', permission=GroupPermission.MEMBER),
+                             group=group)
+
+
+async def _noop():
+    pass
+
+
+def make_engine(graphs: Iterable, handler: Callable = _noop) -> Engine:
+    """Engine with a handler subscribed on each graph"""
+    engine = Engine()
+    for graph in graphs:
+        engine.on(graph)(handler)
+    return engine
+
+
+async def route(engine: Engine, events: Collection, **kwargs) -> float:
+    """Seconds per event of routing events through the engine"""
+    start = time.perf_counter()
+    for event in events:
+        async for _ in engine.forward(event=event, source=source, **kwargs):
+            pass
+    return (time.perf_counter() - start) / len(events)
+
+
+def best_of(repeat: int, run: Callable[[], float]) -> float:
+    """Best result of running a measurement repeatedly"""
+    return min(run() for _ in range(repeat))
+
+
+def best_route(engine: Engine, make_events: Callable[[], List], repeat: int = 5, **kwargs) -> float:
+    """Best seconds per event, events are made fresh each round so nothing
+    memoized on messages is carried over"""
+    loop = asyncio.new_event_loop()
+    try:
+        return best_of(repeat, lambda: loop.run_until_complete(route(engine, make_events(), **kwargs)))
+    finally:
+        loop.close()
+
+
+def print_table(header: List[str], rows: Iterable[List]) -> None:
+    rows = [[f'{cell:.2f}' if isinstance(cell, float) else str(cell) for cell in row] for row in rows]
+    widths = [max(len(str(h)), *(len(row[i]) for row in rows)) for i, h in enumerate(header)]
+    print('  '.join(str(h).rjust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        print('  '.join(cell.rjust(w) for cell, w in zip(row, widths)))
@@ -0,0 +1,85 @@
+"""Event throughput of ordered lanes against one task per event
+
+Events of many conversations are handled by a handler awaiting simulated
+I/O. "Task per event" is the former unbounded model, where each event gets
+its own task and plugins serialize a conversation with their own lock.
+"Ordered lanes" runs the pipeline with `ordered` and no lock. Events handled
+out of arrival order within a conversation are counted as well.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+from ajenga.pipeline import EventPipeline
+from ajenga.router.message import same_event_key
+
+from .common import group_message, print_table, source
+
+
+class _Handler:
+    def __init__(self, work: float, lock: bool):
+        self.work = work
+        self.locks = defaultdict(asyncio.Lock) if lock else None
+        self.last = {}
+        self.out_of_order = 0
+
+    async def handle(self, _source, event, seq: int):
+        key = same_event_key(event)
+        if self.locks is None:
+            await self._handle(key, seq)
+        else:
+            async with self.locks[key]:
+                await self._handle(key, seq)
+
+    async def _handle(self, key, seq: int):
+        # Jittered like real I/O, so unserialized events may overtake
+        await asyncio.sleep(self.work * random.uniform(.5, 1.5))
+        if self.last.get(key, -1) > seq:
+            self.out_of_order += 1
+        self.last[key] = max(self.last.get(key, -1), seq)
+
+
+def _events(conversations: int, per_conversation: int):
+    # Interleaved like live traffic
+    return [(seq, group_message('hi', group=conversation % 100, qq=conversation))
+            for seq in range(per_conversation) for conversation in range(conversations)]
+
+
+async def _run(handler: _Handler, events, workers: int, ordered: bool) -> float:
+    pipeline = EventPipeline(handler.handle, workers=workers, max_size=len(events), ordered=ordered)
+    start = time.perf_counter()
+    futures = [pipeline.submit_nowait(source, event, seq=seq) for seq, event in events]
+    await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+    await pipeline.drain()
+    return len(events) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--per-conversation', type=int, default=20)
+    parser.add_argument('--work', type=float, default=0.001, help='seconds of simulated I/O per event')
+    parser.add_argument('--workers', type=int, default=64)
+    args = parser.parse_args()
+    random.seed(0)
+
+    modes = [
+        ('task per event, lock', 0, False, True),
+        ('task per event, no lock', 0, False, False),
+        ('ordered lanes', args.workers, True, False),
+    ]
+    rows = []
+    for conversations in args.conversations:
+        events = _events(conversations, args.per_conversation)
+        for name, workers, ordered, lock in modes:
+            handler = _Handler(args.work, lock)
+            throughput = asyncio.run(_run(handler, events, workers, ordered))
+            rows.append([conversations, name, throughput, handler.out_of_order])
+    print_table(['conversations', 'mode', 'events/s', 'out of order'], rows)
+
+
+if __name__ == '__main__':
+    main()
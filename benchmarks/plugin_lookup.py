@@ -0,0 +1,125 @@
+"""Cost of resource path lookups resolving the calling plugin
+
+A plugin package is written to a temp directory and imported like real
+plugins. Its functions call `get_current_plugin` and `ensure_file_path`
+without a plugin, at several stack depths. "Former" is the former lookup,
+which collects every frame up to the stack root, finds the module with
+`inspect.getmodule` and probes `get_plugin` with each module name prefix.
+"""
+import argparse
+import importlib
+import inspect
+import os
+import sys
+import tempfile
+import textwrap
+import time
+
+import ajenga
+from ajenga.plugin import Plugin, get_plugin
+from ajenga.plugin.plugin import add_plugin, remove_plugin
+
+from .common import print_table
+
+PLUGIN_SOURCE = textwrap.dedent('''
+    from ajenga.plugin import DirectoryType, ensure_file_path, get_current_plugin
+
+    from benchmarks.plugin_lookup import former_get_current_plugin
+
+
+    def current():
+        return get_current_plugin()
+
+
+    def former_current():
+        return former_get_current_plugin()
+
+
+    def path():
+        return ensure_file_path(None, DirectoryType.TEMP, 'bench.txt')
+
+
+    def former_path():
+        return ensure_file_path(former_get_current_plugin(), DirectoryType.TEMP, 'bench.txt')
+''')
+
+
+def _former_caller_name(skip):
+    def stack_(frame):
+        frame_list = []
+        while frame:
+            frame_list.append(frame)
+            frame = frame.f_back
+        return frame_list
+
+    stack = stack_(sys._getframe(1))
+    start = 0 + skip
+    if len(stack) < start + 1:
+        return ''
+    parent_frame = stack[start]
+
+    module = inspect.getmodule(parent_frame)
+
+    return module
+
+
+def former_get_current_plugin(*, depth=1):
+    module_name = _former_caller_name(depth).__name__
+    while not get_plugin(module_name) and '.' in module_name:
+        module_name, _ = module_name.rsplit('.', maxsplit=1)
+
+    return get_plugin(module_name)
+
+
+def _at_depth(depth: int, func):
+    if depth <= 0:
+        return func()
+    return _at_depth(depth - 1, func)
+
+
+def _per_call(func, depth: int, calls: int, repeat: int) -> float:
+    def run():
+        start = time.perf_counter()
+        for _ in range(calls):
+            _at_depth(depth, func)
+        return (time.perf_counter() - start) / calls
+
+    return min(run() for _ in range(repeat))
+
+
+def _load_bench_plugin(root: str):
+    package = os.path.join(root, 'bench_plugin')
+    os.makedirs(package)
+    with open(os.path.join(package, '__init__.py'), 'w', encoding='utf-8') as f:
+        f.write('')
+    with open(os.path.join(package, 'lookup.py'), 'w', encoding='utf-8') as f:
+        f.write(PLUGIN_SOURCE)
+    sys.path.insert(0, root)
+    plugin = Plugin({'name': 'bench_plugin', 'author': 'bench', 'version': '0', 'usage': ''}, path='bench_plugin')
+    add_plugin(plugin)
+    return plugin, importlib.import_module('bench_plugin.lookup')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--depths', type=int, nargs='+', default=[0, 20, 100, 500])
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    ajenga.config.TEMP_DIR = os.path.join(root, 'temp')
+    plugin, module = _load_bench_plugin(root)
+    assert module.current() is module.former_current() is plugin
+
+    rows = []
+    for depth in args.depths:
+        rows.append([depth, *(_per_call(func, depth, args.calls, args.repeat) * 1e6 for func in (
+            module.current, module.former_current, module.path, module.former_path))])
+    remove_plugin(plugin)
+    print(f'us per call with {len(sys.modules)} modules loaded')
+    print_table(['stack depth', 'get_current_plugin', 'former', 'ensure_file_path', 'former'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Routing cost per message as a function of handler count
+
+Handlers are a mix of startswith, equals, endswith and match, none of them
+matching the message, so every message walks the whole routing graph.
+"Shared" routes with the key functions of `ajenga.router.message`, which
+share memoized message views. "Unshared" recreates the former key functions
+deriving plain text again in each of them. Calls of `MessageChain.as_plain`
+per message are counted as well.
+"""
+import argparse
+import re
+
+from ajenga.message import MessageChain
+from ajenga.router import std
+from ajenga.router.keyfunc import KeyFunctionImpl
+from ajenga.router.message import endswith, equals, is_message, match, startswith
+from ajenga.router.std import EqualNode, make_graph_deco
+from ajenga.router.trie import PrefixNode
+
+from .common import best_route, group_message, make_engine, print_table
+
+MESSAGE = 'hello there, this is an ordinary chat message nobody routes'
+
+_key_lstripped = KeyFunctionImpl(lambda event: event.message.as_plain().lstrip())
+_key_stripped = KeyFunctionImpl(lambda event: event.message.as_plain().strip())
+_key_reversed_lstripped = KeyFunctionImpl(lambda event: event.message.as_plain()[::-1].lstrip())
+
+
+def _unshared_match(pattern: str):
+    pattern = re.compile(pattern)
+    return std.if_(KeyFunctionImpl(lambda event: pattern.match(event.message.as_plain()), key='match'))
+
+
+def shared_graphs(count: int):
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            yield is_message & startswith(f'/cmd{i}')
+        elif kind == 1:
+            yield is_message & equals(f'exact{i}')
+        elif kind == 2:
+            yield is_message & endswith(f'tail{i}')
+        else:
+            yield is_message & match(rf're{i}\s+(\d+)')
+
+
+def unshared_graphs(count: int):
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            yield is_message & make_graph_deco(PrefixNode)(f'/cmd{i}', key=_key_lstripped)
+        elif kind == 1:
+            yield is_message & make_graph_deco(EqualNode)(f'exact{i}', key=_key_stripped)
+        elif kind == 2:
+            yield is_message & make_graph_deco(PrefixNode)(f'tail{i}'[::-1], key=_key_reversed_lstripped)
+        else:
+            yield is_message & _unshared_match(rf're{i}\s+(\d+)')
+
+
+class _PlainCounter:
+    """Counts calls of `MessageChain.as_plain` while active"""
+
+    def __init__(self):
+        self.calls = 0
+        self._as_plain = MessageChain.as_plain
+
+    def __enter__(self):
+        def as_plain(chain, *args, **kwargs):
+            self.calls += 1
+            return self._as_plain(chain, *args, **kwargs)
+
+        MessageChain.as_plain = as_plain
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        MessageChain.as_plain = self._as_plain
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[10, 100, 250, 500, 1000])
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = []
+    for count in args.counts:
+        row = [count]
+        for graphs in (shared_graphs, unshared_graphs):
+            engine = make_engine(graphs(count))
+            row.append(best_route(engine, lambda: [group_message(MESSAGE) for _ in range(args.messages)],
+                                  args.repeat) * 1e6)
+            with _PlainCounter() as counter:
+                best_route(engine, lambda: [group_message(MESSAGE)], 1)
+            row.append(counter.calls)
+        rows.append(row)
+    print_table(['handlers', 'shared us/msg', 'as_plain', 'unshared us/msg', 'as_plain'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Routing cost of N services x M groups with services disabled by group
+
+Every service has a few command handlers and is enabled in a fraction of
+the groups, from few (most services pruned) to most. "Service.on" checks
+the enable mask after the merged keyed nodes, so command tries are shared
+by all services. "Root node" puts the mask check before the user graph,
+splitting the tries per service. "Leaf predicate" is the original
+`Service.on` checking enablement in the privilege predicate. Messages are
+commands of random services sent in random groups, mixed with plain chat.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+
+import ajenga
+
+# Keep benchmark services out of the real config store
+ajenga.config.SERVICE_CONFIG_DB = os.path.join(tempfile.mkdtemp(), 'services.db')
+
+from ajenga import app
+from ajenga.plugin import Plugin, Service, set_current_plugin
+from ajenga.plugin.service import ServiceGraphImpl, _ServiceNode
+from ajenga.router.engine import Engine
+from ajenga.router.keyfunc import PredicateFunction
+from ajenga.router.message import is_message, startswith
+from ajenga.router.std import PredicateNode, make_graph_deco
+
+from .common import group_message, print_table, route
+
+
+def _root_node_on(sv: Service, graph):
+    return ServiceGraphImpl(sv) & make_graph_deco(_ServiceNode)(sv) & graph & PredicateNode(
+        PredicateFunction(lambda event: sv.check_priv(event), notation=sv))
+
+
+def _leaf_predicate_on(sv: Service, graph):
+    return ServiceGraphImpl(sv) & graph & PredicateNode(
+        PredicateFunction(lambda event: sv.check_priv(event), notation=sv))
+
+
+MODES = {
+    'service_on': Service.on,
+    'root_node': _root_node_on,
+    'leaf_predicate': _leaf_predicate_on,
+}
+
+
+async def _noop():
+    pass
+
+
+def _setup(name: str, services: int, groups: int, commands: int, enabled: float, mode: str) -> Engine:
+    app.engine = Engine()
+    set_current_plugin(Plugin({'name': name, 'author': 'bench', 'version': '0', 'usage': ''}))
+    rng = random.Random(0)
+    on = MODES[mode]
+    for i in range(services):
+        sv = Service(f'sv{i}', enable_on_default=False)
+        for group in range(groups):
+            if rng.random() < enabled:
+                sv.set_enable(group)
+        for j in range(commands):
+            on(sv, is_message & startswith(f'/s{i}c{j}'))(_noop)
+    return app.engine
+
+
+def _messages(count: int, services: int, groups: int, commands: int):
+    rng = random.Random(1)
+    events = []
+    for _ in range(count):
+        if rng.random() < .5:
+            text = f'/s{rng.randrange(services)}c{rng.randrange(commands)} arg'
+        else:
+            text = 'just chatting'
+        events.append(group_message(text, group=rng.randrange(groups)))
+    return events
+
+
+async def _bench(args):
+    rows = []
+    for enabled in args.enabled:
+        for services in args.services:
+            row = [enabled, services]
+            for mode in MODES:
+                engine = _setup(f'bench_{mode}_{enabled}_{services}',
+                                services, args.groups, args.commands, enabled, mode)
+                best = min([await route(engine, _messages(args.messages, services, args.groups, args.commands))
+                            for _ in range(args.repeat)])
+                row.append(best * 1e6)
+            rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--services', type=int, nargs='+', default=[10, 50, 200, 500])
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--commands', type=int, default=5, help='command handlers of each service')
+    parser.add_argument('--enabled', type=float, nargs='+', default=[.1, .9],
+                        help='fractions of groups enabling a service')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = asyncio.run(_bench(args))
+    print(f'us per message, {args.groups} groups')
+    print_table(['enabled', 'services', *MODES], rows)
+
+
+if __name__ == '__main__':
+    main()
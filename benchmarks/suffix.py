@@ -0,0 +1,57 @@
+"""Suffix routing cost per message from 10 B to 100 KB
+
+"Suffix node" routes by `endswith`, walking a trie of reversed suffixes
+back from the end of the shared plain view. "Reversed prefix" is the former
+`endswith`, a prefix trie over a reversed copy of the message made by its
+key function on every event. "Shared reversed" is the same prefix trie over
+the memoized reversed view.
+"""
+import argparse
+
+from ajenga.router.keyfunc import KeyFunctionImpl
+from ajenga.router.message import endswith, is_message, key_message_content_string_reversed_lstripped
+from ajenga.router.std import make_graph_deco
+from ajenga.router.trie import PrefixNode
+
+from .common import best_route, group_message, make_engine, print_table
+
+_key_reversed_lstripped = KeyFunctionImpl(lambda event: event.message.as_plain()[::-1].lstrip())
+
+
+def _suffixes(count: int):
+    return [f'{i}:tail' for i in range(count)]
+
+
+def suffix_node_graphs(count: int):
+    return [is_message & endswith(suffix) for suffix in _suffixes(count)]
+
+
+def reversed_prefix_graphs(count: int, key=_key_reversed_lstripped):
+    return [is_message & make_graph_deco(PrefixNode)(suffix[::-1], key=key) for suffix in _suffixes(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--handlers', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    engines = [
+        make_engine(suffix_node_graphs(args.handlers)),
+        make_engine(reversed_prefix_graphs(args.handlers)),
+        make_engine(reversed_prefix_graphs(args.handlers, key_message_content_string_reversed_lstripped)),
+    ]
+    rows = []
+    for size in args.sizes:
+        # Ends like every suffix but matches none
+        text = 'x' * (size - 5) + ':tail'
+        rows.append([size, *(best_route(engine, lambda: [group_message(text) for _ in range(args.messages)],
+                                        args.repeat) * 1e6 for engine in engines)])
+    print(f'{args.handlers} suffix handlers, us per message')
+    print_table(['bytes', 'suffix node', 'reversed prefix', 'shared reversed'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import asyncio
+import json
+import sys
+
+import ajenga
+from ajenga.plugin import get_plugin, load_plugins, unload_plugin
+
+
+def _write_plugin(plugin_dir, name, source='', **info):
+    plugin_dir.mkdir(parents=True)
+    (plugin_dir / '__init__.py').write_text(source, encoding='utf-8')
+    (plugin_dir / ajenga.config.PLUGIN_INFO_FILE).write_text(json.dumps({
+        'name': name,
+        'author': 'test',
+        'version': '0.1',
+        'usage': '',
+        **info,
+    }), encoding='utf-8')
+
+
+def test_load_plugins_from_default_dir(tmp_path, monkeypatch):
+    plugins = tmp_path / 'plugins'
+    _write_plugin(plugins / 'alpha', 'alpha', 'VALUE = 1\n')
+    _write_plugin(plugins / 'beta', 'beta', 'from plugins.alpha import VALUE\n', dependencies=['alpha'])
+    (plugins / 'not_a_plugin').mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    assert ajenga.config.PLUGIN_DIR == './plugins'
+
+    async def _run():
+        reports = await load_plugins()
+        try:
+            assert sorted(report.module_path for report in reports) == ['plugins.alpha', 'plugins.beta']
+            assert [report.error for report in reports] == [None, None]
+            for name in ('alpha', 'beta'):
+                plugin = get_plugin(name)
+                assert plugin is not None
+                assert plugin.module is sys.modules[f'plugins.{name}']
+                assert get_plugin(f'plugins.{name}') is plugin
+        finally:
+            for name in ('beta', 'alpha'):
+                if get_plugin(name):
+                    await unload_plugin(name)
+        assert 'plugins.alpha' not in sys.modules
+
+    asyncio.run(_run())